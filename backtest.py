@@ -0,0 +1,293 @@
+# backtest.py
+"""
+過去の出馬表（着順入り）で予測を再現し、AI指数・印が実際の結果にどう結びついたかを集計します。
+
+    python backtest.py past/*.csv --model-dir models/v1
+    python backtest.py past/*.csv --model 231001=models/v1 --model 240401=models/v2 --out backtest_out
+
+- CSVはチャンクごとに読み、日付（列0）ごとのカードに分けて複数プロセスで並列に予測します
+  （予測中のカードは一定数までにするので、何年分のCSVでもメモリに載るのは数日分だけです）
+- --model 開始日=フォルダ を複数指定すると、各日付はその日までに有効なモデルで予測します（ウォークフォワード）
+- 予測結果はカードとモデルごとに cache/backtest/ に保存され、集計だけを変えた再実行では予測し直しません
+
+着順・オッズの列番号は jra1217.csv 形式の想定です（着順=23, 単勝オッズ=30）。
+形式が異なる場合は --finish-col / --odds-col で指定してください。着順が 0 以下の行（未確定・取消）は集計から除きます。
+"""
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import incremental
+import logic
+import stream_predict
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "backtest")
+
+# 元CSVの列番号
+DATE_COL = 0
+FINISH_COL = 23
+ODDS_COL = 30
+# 1枚のカードの最大レース数（1日分が収まる数。これを超える日は複数のカードに分かれます）
+CARD_MAX_RACES = 200
+# ワーカー1つあたりの、予測中にしておくカードの数
+PENDING_PER_WORKER = 2
+# 予測に使う列（キャッシュのキーはこの列だけから作ります）
+CARD_COLUMNS = [DATE_COL] + list(logic.RENAME_MAP)
+
+# 馬を特定するキー（予測結果側の列名）
+KEY_COLUMNS = ['場所', 'R', '番']
+# AI順位の区分
+RANK_BINS = [0, 1, 2, 3, 5, 8, np.inf]
+RANK_LABELS = ['1', '2', '3', '4-5', '6-8', '9-']
+# 較正曲線の区分数（AI指数 0-100 を等間隔に分けます）
+CALIBRATION_BINS = 10
+# 較正曲線で「的中」とみなす着順（この着順以内）
+CALIBRATION_TOP = 3
+# 単勝の購入額（ROIは払戻合計 / 購入合計）
+STAKE = 100
+
+
+# ---------------------------------------------------------
+# カードの読み込み・モデルの割り当て
+# ---------------------------------------------------------
+def iter_cards(sources, chunksize=stream_predict.DEFAULT_CHUNKSIZE, max_races=CARD_MAX_RACES, encoding=None):
+    """
+    CSVファイルをチャンクごとに読み、(日付, 1日分のカード) を順に返します。
+    （stream_predict.iter_race_batches と同じく、同じ日付・レースの行は連続している前提です）
+    """
+    for source in sources:
+        for card in stream_predict.iter_race_batches(source, chunksize, max_races, encoding):
+            yield card[DATE_COL].iloc[0], card.reset_index(drop=True)
+
+
+class ModelSchedule:
+    """
+    開始日 -> モデルフォルダ の対応。各日付には、その日以前で最も新しい開始日のモデルを使います。
+    model_dirs はフォルダのパス1つ、または {開始日: フォルダ} です。
+    """
+
+    def __init__(self, model_dirs):
+        if isinstance(model_dirs, (str, os.PathLike)):
+            model_dirs = {0: model_dirs}
+        items = sorted((int(d), m) for d, m in model_dirs.items())
+        self.starts = [d for d, _ in items]
+        self.model_dirs = [m for _, m in items]
+
+    def model_for(self, date):
+        """date に使うモデルフォルダ（該当なしなら None）。"""
+        pos = bisect.bisect_right(self.starts, int(date)) - 1
+        return self.model_dirs[pos] if pos >= 0 else None
+
+
+# ---------------------------------------------------------
+# 予測のキャッシュ（incremental.RaceCache に カードのキー -> 1日分の予測結果 を保存します）
+# ---------------------------------------------------------
+def card_key(card, model_key):
+    """予測に使う列とモデルから作るキャッシュのキー（着順などの結果列は含めません）。"""
+    cols = [c for c in CARD_COLUMNS if c in card.columns]
+    h = hashlib.sha1(model_key.encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(card[cols], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------
+# 予測と結果の突き合わせ
+# ---------------------------------------------------------
+def _outcomes(card, finish_col, odds_col):
+    """カードから 場所・R・番・着順・単勝オッズ を取り出します。"""
+    out = pd.DataFrame({
+        '場所': card[1].astype(str).str.strip(),
+        'R': pd.to_numeric(card[2], errors='coerce'),
+        '番': pd.to_numeric(card[3], errors='coerce'),
+        '着順': pd.to_numeric(card[finish_col], errors='coerce'),
+        '単勝オッズ': pd.to_numeric(card[odds_col], errors='coerce') if odds_col is not None else np.nan,
+    })
+    return out.dropna(subset=['R', '番'])
+
+
+def _join(date, model_dir, result_df, outcomes):
+    preds = result_df[KEY_COLUMNS + ['AI順位', '印', 'AI指数']].copy()
+    preds['場所'] = preds['場所'].astype(str)
+    preds['R'] = pd.to_numeric(preds['R'], errors='coerce')
+    preds['番'] = pd.to_numeric(preds['番'], errors='coerce')
+    df = preds.merge(outcomes, on=KEY_COLUMNS, how='inner')
+    df.insert(0, '日付', date)
+    df.insert(1, 'モデル', os.path.basename(os.path.normpath(model_dir)))
+    return df
+
+
+def collect_predictions(sources, model_dirs, finish_col=FINISH_COL, odds_col=ODDS_COL,
+                        cache=None, max_workers=None, encoding=None, chunksize=stream_predict.DEFAULT_CHUNKSIZE):
+    """
+    全カードを予測し（キャッシュがあれば使い）、着順と突き合わせた1つのDataFrameを返します。
+    戻り値: (DataFrame, {日付: エラーメッセージ})
+    列: 日付, モデル, 場所, R, 番, AI順位, 印, AI指数, 着順, 単勝オッズ
+    """
+    schedule = ModelSchedule(model_dirs)
+    cache = cache or incremental.RaceCache(DEFAULT_CACHE_DIR)
+    model_keys = {}
+    frames, errors, pending = [], {}, deque()
+
+    def collect(date, model_dir, key, outcomes, future):
+        try:
+            result_df, error_msg = future.result()
+        except Exception as e:
+            result_df, error_msg = None, f"予測エラー: {e}"
+        if error_msg:
+            errors[date] = error_msg
+            return
+        cache.put(key, result_df)
+        frames.append(_join(date, model_dir, result_df, outcomes))
+
+    workers = max_workers or os.cpu_count() or 1
+    # multi_model と同じく、親のスレッドが持つロックを複製しないようワーカーは spawn で起動します
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for date, card in iter_cards(sources, chunksize, encoding=encoding):
+            model_dir = schedule.model_for(date)
+            if model_dir is None:
+                errors[date] = "この日付に使えるモデルがありません。"
+                continue
+            try:
+                if model_dir not in model_keys:
+                    model_keys[model_dir] = incremental.model_key(model_dir)
+            except FileNotFoundError as e:
+                errors[date] = f"モデルファイルが見つかりません: {e}"
+                continue
+
+            key = card_key(card, model_keys[model_dir])
+            outcomes = _outcomes(card, finish_col, odds_col)
+            cached = cache.get(key)
+            if cached is not None:
+                frames.append(_join(date, model_dir, cached, outcomes))
+                continue
+
+            # 予測中のカードが多くなったら、古いものから結果を受け取ってから次を読みます
+            while len(pending) >= workers * PENDING_PER_WORKER:
+                collect(*pending.popleft())
+            future = executor.submit(logic.execute_prediction, card[[c for c in CARD_COLUMNS if c in card.columns]], model_dir)
+            pending.append((date, model_dir, key, outcomes, future))
+
+        while pending:
+            collect(*pending.popleft())
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not df.empty:
+        df = df[df['着順'] > 0].sort_values(['日付', '場所', 'R', 'AI順位'], kind='stable').reset_index(drop=True)
+    return df, errors
+
+
+# ---------------------------------------------------------
+# 集計
+# ---------------------------------------------------------
+def _bet_summary(df, by):
+    """by ごとの 頭数・勝率・複勝率・単勝回収率。"""
+    won = df['着順'] == 1
+    g = df.assign(
+        _win=won,
+        _top3=df['着順'] <= 3,
+        _return=np.where(won, df['単勝オッズ'].fillna(0) * STAKE, 0.0),
+    ).groupby(by, observed=True)
+    out = pd.DataFrame({
+        '頭数': g.size(),
+        '勝率': g['_win'].mean(),
+        '複勝率': g['_top3'].mean(),
+        '単勝回収率': g['_return'].sum() / (g.size() * STAKE),
+    })
+    return out.reset_index()
+
+
+def by_date(df):
+    """日付ごとの レース数・AI1位の勝率・複勝率・単勝回収率。"""
+    top = df[df['AI順位'] == 1]
+    return _bet_summary(top, ['日付', 'モデル']).rename(columns={'頭数': 'レース数'})
+
+
+def by_mark(df):
+    """印ごとの成績。"""
+    return _bet_summary(df.assign(印=df['印'].fillna('').replace('', '(なし)')), '印')
+
+
+def by_rank(df):
+    """AI順位の区分ごとの成績。"""
+    bucket = pd.cut(df['AI順位'], RANK_BINS, labels=RANK_LABELS)
+    return _bet_summary(df.assign(AI順位=bucket), 'AI順位')
+
+
+def calibration(df, bins=CALIBRATION_BINS, top=CALIBRATION_TOP):
+    """AI指数の区分ごとの 予測確率の平均 と 実際の着順 top 以内の割合。"""
+    edges = np.linspace(0, 100, bins + 1)
+    bucket = pd.cut(df['AI指数'], edges, include_lowest=True)
+    g = df.assign(_hit=df['着順'] <= top, _prob=df['AI指数'] / 100).groupby(bucket, observed=True)
+    return pd.DataFrame({
+        '頭数': g.size(),
+        '予測確率': g['_prob'].mean(),
+        '実績率': g['_hit'].mean(),
+    }).rename_axis('AI指数').reset_index()
+
+
+def summarize(df):
+    """集計結果一式 {'by_date', 'by_mark', 'by_rank', 'calibration'} を返します。"""
+    return {
+        'by_date': by_date(df),
+        'by_mark': by_mark(df),
+        'by_rank': by_rank(df),
+        'calibration': calibration(df),
+    }
+
+
+def run_backtest(sources, model_dirs, **kwargs):
+    """
+    予測と集計をまとめて行います。
+    戻り値: (集計結果の dict, 突き合わせ済みDataFrame, {日付: エラーメッセージ})
+    """
+    df, errors = collect_predictions(sources, model_dirs, **kwargs)
+    if df.empty:
+        return {}, df, errors
+    return summarize(df), df, errors
+
+
+def _parse_models(values, model_dir):
+    if not values:
+        return model_dir
+    schedule = {}
+    for v in values:
+        start, _, path = v.partition("=")
+        schedule[int(start)] = path
+    return schedule
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="過去の出馬表でのバックテスト")
+    parser.add_argument("sources", nargs="+", help="着順入りの出馬表CSV（jra1217.csv 形式）")
+    parser.add_argument("--model-dir", default="models/v1")
+    parser.add_argument("--model", action="append", metavar="開始日=フォルダ",
+                        help="ウォークフォワード用のモデル（例: 240401=models/v2）。複数指定できます")
+    parser.add_argument("--finish-col", type=int, default=FINISH_COL)
+    parser.add_argument("--odds-col", type=int, default=ODDS_COL)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--out", help="集計結果のCSVを書き出すフォルダ")
+    args = parser.parse_args()
+
+    report, joined, errors = run_backtest(
+        args.sources, _parse_models(args.model, args.model_dir),
+        finish_col=args.finish_col, odds_col=args.odds_col,
+        cache=incremental.RaceCache(args.cache_dir), max_workers=args.workers)
+
+    for date, msg in errors.items():
+        print(f"[{date}] {msg}")
+    if not report:
+        print("集計できるレースがありません（着順が未確定の可能性があります）。")
+    for name, table in report.items():
+        print(f"\n== {name} ==")
+        print(table.to_string(index=False))
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            table.to_csv(os.path.join(args.out, f"{name}.csv"), index=False, encoding='utf-8-sig')
@@ -0,0 +1,217 @@
+# benchmark.py
+"""
+予測処理のベンチマーク。
+
+    python benchmark.py --model-dir models/v1 --sizes 1 36 288 3456
+
+jra1217.csv と同じ列番号形式の出馬表をランダムに作り、
+学習済みモデル(jra_3y_model.pkl)の代わりに同じ predict_proba を持つ StandInModel を使って、
+段階ごと（読み込み・前処理・特徴量・推論・整形・書き込み）の処理時間と最大メモリを計測します。
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import logic
+import result_store
+import stats_index
+from model_bundle import STATS_FILES, ModelBundle
+
+# 1日 = 3場 × 12R、1シーズン ≒ 3456レース
+SIZE_PRESETS = {'race': 1, 'day': 36, 'weekend': 72, 'month': 288, 'season': 3456}
+RACES_PER_DATE = 36
+N_COLUMNS = 33
+
+PLACES = ['中山', '阪神', '中京', '東京', '京都', '新潟', '福島', '小倉', '札幌', '函館']
+TRACKS = ['芝', 'ダ', '障']
+DISTANCES = [1000, 1200, 1400, 1600, 1800, 2000, 2200, 2400, 2500, 3000, 3600]
+SEXES = ['牡', '牝', 'セ']
+
+
+# ---------------------------------------------------------
+# ダミーデータ
+# ---------------------------------------------------------
+class StandInModel:
+    """学習済みモデルの代わり（特徴量の重み付き和のロジスティック関数）。"""
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.coef = rng.normal(0, 1, len(logic.FEATURES))
+        self.intercept = -1.5
+
+    def predict_proba(self, X):
+        z = np.asarray(X, dtype=float) @ self.coef + self.intercept
+        p = 1 / (1 + np.exp(-z))
+        return np.column_stack([1 - p, p])
+
+
+def _names(stats, fallback):
+    index = getattr(stats, 'vocab', None)
+    if index is None:
+        index = stats.index if hasattr(stats, 'index') else list(stats)
+    names = [n for n in index if isinstance(n, str)]
+    return np.array(names or fallback, dtype=object)
+
+
+def make_synthetic_card(n_races, bundle=None, horses=(8, 18), unknown_rate=0.1, seed=0, start_date=250105):
+    """
+    n_races レース分の出馬表（列番号 0..32、header=None で読んだ形）を作ります。
+    bundle を渡すと、名前をその統計に含まれる名前から選びます（unknown_rate の割合で未知の名前）。
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(horses[0], horses[1] + 1, n_races)
+    n = int(sizes.sum())
+    race_of_row = np.repeat(np.arange(n_races), sizes)
+    horse_no = np.concatenate([np.arange(1, s + 1) for s in sizes]) if n_races else np.empty(0, dtype=int)
+
+    # レースごとの情報（1日あたり RACES_PER_DATE レース、1場12R）
+    date_idx = np.arange(n_races) // RACES_PER_DATE
+    in_day = np.arange(n_races) % RACES_PER_DATE
+    race_dates = start_date + date_idx
+    race_places = np.array(PLACES, dtype=object)[(in_day // 12 + date_idx * 3) % len(PLACES)]
+    race_nums = in_day % 12 + 1
+    race_tracks = np.array(TRACKS, dtype=object)[rng.choice(3, n_races, p=[0.45, 0.5, 0.05])]
+    race_dists = np.array(DISTANCES)[rng.integers(0, len(DISTANCES), n_races)]
+
+    def pick(stats, prefix):
+        pool = _names(stats, [f"{prefix}{i}" for i in range(200)]) if stats is not None else \
+            np.array([f"{prefix}{i}" for i in range(200)], dtype=object)
+        out = pool[rng.integers(0, len(pool), n)]
+        unknown = rng.random(n) < unknown_rate
+        out[unknown] = [f"{prefix}?{i}" for i in rng.integers(0, 10000, unknown.sum())]
+        return out
+
+    b = bundle
+    df = pd.DataFrame({i: np.zeros(n, dtype=int) for i in range(N_COLUMNS)})
+    df[0] = race_dates[race_of_row]
+    df[1] = race_places[race_of_row]
+    df[2] = race_nums[race_of_row]
+    df[3] = horse_no
+    df[4] = np.where(race_nums[race_of_row] <= 3, "未勝利", "1勝クラス")
+    df[5] = race_tracks[race_of_row]
+    df[6] = race_dists[race_of_row]
+    df[7] = [f"ホース{i}" for i in range(n)]
+    df[8] = np.array(SEXES, dtype=object)[rng.integers(0, 3, n)]
+    df[9] = rng.integers(2, 8, n)
+    df[10] = pick(b.jockey_stats if b else None, "騎手")
+    df[11] = rng.choice([54.0, 55.0, 56.0, 57.0, 58.0], n)
+    df[12] = pick(b.trainer_stats if b else None, "調教師")
+    df[13] = rng.choice(['美', '栗'], n)
+    df[14] = [f"馬主{i}" for i in rng.integers(0, 500, n)]
+    df[15] = pick(b.breeder_stats if b else None, "生産者")
+    df[16] = pick(b.sire_stats if b else None, "種牡馬")
+    df[17] = [f"母{i}" for i in rng.integers(0, 5000, n)]
+    df[18] = rng.integers(20000000, 24000000, n)
+    df[20] = pick(b.bms_stats if b else None, "母父馬")
+    df[21] = rng.choice(['鹿毛', '栗毛', '黒鹿毛', '芦毛'], n)
+    # 枠番: 頭数に応じて 1..8
+    field = sizes[race_of_row]
+    df[22] = np.minimum(8, np.ceil(horse_no * 8 / np.maximum(field, 8))).astype(int)
+    df[23] = -1
+    df[26] = field
+    df[32] = rng.integers(100000000, 999999999, n)
+    return df
+
+
+def load_standin_bundle(model_dir, seed=0):
+    """
+    model_dir の統計と StandInModel で ModelBundle を作ります。
+    （jra_3y_model.pkl が無いフォルダでも計測できます）
+    """
+    stats = stats_index.load_indexes(model_dir) or {}
+    for key, fname in STATS_FILES.items():
+        if key not in stats:
+            stats[key] = joblib.load(os.path.join(model_dir, fname))
+    return ModelBundle(model_dir, StandInModel(seed), stats, signature=None)
+
+
+# ---------------------------------------------------------
+# 計測
+# ---------------------------------------------------------
+STAGES = ['load', 'rename_clean', 'features', 'inference', 'assembly', 'write']
+
+
+def run_pipeline(card, model_dir, out_dir):
+    """1回分の予測を段階ごとに計測します。{段階: 秒} と結果の行数を返します。"""
+    timings = {}
+
+    t = time.perf_counter()
+    bundle = load_standin_bundle(model_dir)
+    timings['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    df_all = logic.prepare_input(card)
+    timings['rename_clean'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    df = logic.build_features(df_all, bundle)
+    timings['features'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    df['AI指数'] = logic.predict_scores(df, bundle.model)
+    timings['inference'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    result_df = logic.assemble_results(logic.rank_races(df))
+    timings['assembly'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    result_store.ResultStore(out_dir, keep_runs=1).publish(result_df, model_version="benchmark")
+    timings['write'] = time.perf_counter() - t
+
+    return timings, len(result_df)
+
+
+def benchmark(model_dir, sizes, repeat=3, seed=0):
+    """
+    sizes（レース数）ごとに repeat 回実行し、段階ごとの中央値と最大メモリを返します。
+    メモリは計測のオーバーヘッドが大きいため、時間とは別にもう1回実行して測ります。
+    """
+    base = load_standin_bundle(model_dir)
+    rows = []
+    for n_races in sizes:
+        card = make_synthetic_card(n_races, base, seed=seed)
+        with tempfile.TemporaryDirectory() as out_dir:
+            samples = [run_pipeline(card, model_dir, out_dir)[0] for _ in range(repeat)]
+
+            tracemalloc.start()
+            _, n_rows = run_pipeline(card, model_dir, out_dir)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        row = {'races': n_races, 'rows': n_rows}
+        for stage in STAGES:
+            row[stage] = float(np.median([s[stage] for s in samples]))
+        row['total'] = sum(row[stage] for stage in STAGES)
+        row['peak_mb'] = peak / 1024 ** 2
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _parse_size(value):
+    return SIZE_PRESETS[value] if value in SIZE_PRESETS else int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="予測処理のベンチマーク")
+    parser.add_argument("--model-dir", default=os.path.join("models", "v1"))
+    parser.add_argument("--sizes", nargs="+", default=['race', 'day', 'weekend', 'month', 'season'],
+                        help="レース数、または " + "/".join(SIZE_PRESETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    result = benchmark(args.model_dir, [_parse_size(s) for s in args.sizes], args.repeat, args.seed)
+    with pd.option_context('display.width', 200, 'display.float_format', '{:.4f}'.format):
+        print(result.to_string(index=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result.to_dict(orient='records'), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,158 @@
+# dashboard_data.py
+"""
+メンバー画面用のデータを、公開中の予測(run)ごとに1回だけ準備して使い回します。
+管理者が新しい予測を公開すると CURRENT が変わるので、次の再描画で自動的に読み直されます。
+"""
+import os
+import threading
+
+import logic
+import race_display
+import result_store
+from model_bundle import get_bundle
+
+MODELS_DIR = "models"
+
+# メンバー画面に表示する列
+DISPLAY_COLUMNS = race_display.DISPLAY_COLUMNS
+
+
+class DashboardData:
+    """1つの run の場所・レース一覧と、レースごとの表示用DataFrame。"""
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+        manifest = store.manifest(run_id)
+        self.model_version = manifest.get('model_version')
+
+        # 日付 -> 場所 -> [R, ...]（昇順）、(日付, 場所, R) -> レース名
+        # （日付の無い結果では日付は None）
+        self.race_index = {}
+        self.race_names = {}
+        for r in manifest['races']:
+            date = r.get('日付')
+            self.race_index.setdefault(date, {}).setdefault(r['場所'], []).append(r['R'])
+            self.race_names[(date, r['場所'], r['R'])] = r.get('レース名', "")
+        for places in self.race_index.values():
+            for place in places:
+                places[place].sort()
+
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    @property
+    def dates(self):
+        """日付の一覧（昇順）。"""
+        return sorted(self.race_index, key=lambda d: (d is not None, d))
+
+    @property
+    def latest_date(self):
+        dates = self.dates
+        return dates[-1] if dates else None
+
+    def locations(self, date=None):
+        return list(self.race_index.get(self._date(date), {}))
+
+    def races(self, place, date=None):
+        return self.race_index.get(self._date(date), {}).get(place, [])
+
+    def race_name(self, place, race, date=None):
+        return self.race_names.get((self._date(date), place, race), "")
+
+    def _date(self, date):
+        # 日付の指定が無ければ最新の日付
+        return self.latest_date if date is None else date
+
+    def race_frame(self, place, race, role=race_display.DEFAULT_ROLE, date=None):
+        """表示用に整形済みの1レース分のDataFrame（無ければ None）。表示する列は role で変わります。"""
+        columns = race_display.columns_for(role)
+        date = self._date(date)
+        key = (date, place, race, tuple(columns))
+        if key not in self._frames:
+            with self._lock:
+                if key not in self._frames:
+                    self._frames[key] = self._build_frame(date, place, race, columns)
+        return self._frames[key]
+
+    def _build_frame(self, date, place, race, columns):
+        if set(columns) <= set(DISPLAY_COLUMNS):
+            # 公開時に作成済みの payload を読むだけ
+            df = self.store.read_display(place, race, self.run_id, date)
+            if df is not None:
+                df = df[[c for c in columns if c in df.columns]]
+        else:
+            df = self.store.read_race(place, race, self.run_id, date)
+            if df is not None:
+                df = race_display.make_payload(df, columns)
+        if df is None or df.empty:
+            return None
+        return df
+
+    def race_page(self, place, page=1, page_size=race_display.DEFAULT_PAGE_SIZE, role=race_display.DEFAULT_ROLE,
+                  date=None):
+        """
+        複数レース表示用。place のレースを page_size ずつに分けた page ページ目を返します。
+        戻り値: ([(R, レース名, DataFrame または None), ...], 全ページ数)
+        """
+        races, n_pages = race_display.paginate(self.races(place, date), page, page_size)
+        return [(r, self.race_name(place, r, date), self.race_frame(place, r, role, date)) for r in races], n_pages
+
+    # --- コース枠（予測を実行せずにモデルの統計から表示） ---
+    def _bundle(self):
+        if not self.model_version:
+            return None
+        try:
+            return get_bundle(os.path.join(MODELS_DIR, self.model_version))
+        except Exception:
+            return None
+
+    def courses(self):
+        """コース枠の統計があるコースID一覧（モデルが読めなければ空）。"""
+        bundle = self._bundle()
+        return [] if bundle is None else [str(c) for c in bundle.cf_matrix.courses]
+
+    def course_frame_table(self, course_id):
+        """公開中の予測と同じモデルでの、枠番ごとのコース枠スコアと枠評（モデルが読めなければ None）。"""
+        bundle = self._bundle()
+        return None if bundle is None else logic.course_frame_table(bundle, course_id)
+
+
+# ---------------------------------------------------------
+# プロセス共通のキャッシュ（全セッションで共有）
+# ---------------------------------------------------------
+_cache = {}
+_lock = threading.Lock()
+
+
+def _version_key(store):
+    """公開中の run_id と CURRENT の更新時刻。"""
+    path = os.path.join(store.root, result_store.CURRENT_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return (store.current_run(), mtime)
+
+
+def get_dashboard_data(store):
+    """
+    公開中の予測の DashboardData を返します（公開前は None）。
+    CURRENT が変わらない限り、同じオブジェクトを返します。
+    """
+    version = _version_key(store)
+    if version is None or version[0] is None:
+        return None
+
+    root = os.path.abspath(store.root)
+    cached = _cache.get(root)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _lock:
+        cached = _cache.get(root)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        data = DashboardData(store, version[0])
+        _cache[root] = (version, data)
+        return data
@@ -0,0 +1,147 @@
+# incremental.py
+"""
+出馬表の一部だけが変わったとき（出走取消・乗り替わりなど）に、変わったレースだけを予測し直します。
+
+レース（日付, 開催, Ｒ）ごとに入力行とモデルのバージョンから指紋(fingerprint)を作り、
+同じ指紋の結果がキャッシュ（cache/races/）にあればそれを使います。
+日付（列0）がある出馬表では、結果にも stream_predict と同じく '日付' 列が付きます。
+"""
+import hashlib
+import os
+import time
+
+import pandas as pd
+
+import logic
+from model_bundle import ModelBundle, file_signature
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "races")
+# 元CSVの日付の列（prepare_input では名前を付け替えません）
+DATE_COL = 0
+# 指紋に含める列（日付と、prepare_input で名前を付けた予測の入力列）
+FINGERPRINT_COLUMNS = [DATE_COL] + list(logic.RENAME_MAP.values())
+# これより古いキャッシュは prune() で削除します
+MAX_AGE_DAYS = 14
+
+
+def model_key(model):
+    """
+    モデルフォルダとファイルの更新状況から作るキー。
+    model は ModelBundle またはフォルダのパスです（パスなら読み込まずにファイルの状態だけを見ます）。
+    """
+    if isinstance(model, ModelBundle):
+        model_dir, signature = model.model_dir, model.signature
+    else:
+        model_dir, signature = model, file_signature(model)
+    raw = repr((os.path.abspath(model_dir), signature)).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def race_fingerprints(df_all, key):
+    """
+    前処理済みの出馬表から、レースごとの指紋を返します。
+    戻り値: {(日付, 開催, Ｒ): 指紋}（日付の列が無ければ日付は None）
+    """
+    df = df_all.dropna(subset=['開催', 'Ｒ'])
+    # 予測に使う列だけで作ります（着順・オッズなど、予測に関係ない列が変わっても再計算しないように）
+    cols = [c for c in FINGERPRINT_COLUMNS if c in df.columns]
+    row_hash = pd.util.hash_pandas_object(df[cols], index=False)
+    dates = df[DATE_COL] if DATE_COL in df.columns else pd.Series(-1, index=df.index)
+    fingerprints = {}
+    for (date, place, race), hashes in row_hash.groupby([dates, df['開催'], df['Ｒ']], sort=True, observed=True):
+        h = hashlib.sha1(key.encode('utf-8'))
+        h.update(hashes.to_numpy().tobytes())
+        fingerprints[(None if DATE_COL not in df.columns else date, place, race)] = h.hexdigest()
+    return fingerprints
+
+
+class RaceCache:
+    """指紋 -> 1レース分の予測結果 のキャッシュ。"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.pkl")
+
+    def get(self, fingerprint):
+        try:
+            return pd.read_pickle(self._path(fingerprint))
+        except (FileNotFoundError, EOFError):
+            return None
+
+    def put(self, fingerprint, result_df):
+        path = self._path(fingerprint)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        result_df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def prune(self, max_age_days=MAX_AGE_DAYS):
+        limit = time.time() - max_age_days * 86400
+        for fname in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fname)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except FileNotFoundError:
+                # 別のジョブが同時に片付けた場合
+                pass
+
+
+def predict_incremental(input_df, model_dir, cache=None):
+    """
+    変わったレースだけを予測し、変わっていないレースはキャッシュの結果を使います。
+    戻り値は execute_prediction と同じ (結果DataFrame, エラーメッセージ) です。
+    再利用・再計算したレース数は result_df.attrs['incremental'] に入ります。
+    """
+    cache = cache or RaceCache()
+    bundle, error_msg = logic.resolve_bundle(model_dir)
+    if error_msg:
+        return None, error_msg
+
+    df_all = logic.prepare_input(input_df)
+    if '開催' not in df_all.columns or 'Ｒ' not in df_all.columns:
+        return None, "CSVの形式が正しくありません（開催・R列不足）"
+
+    fingerprints = race_fingerprints(df_all, model_key(bundle))
+
+    results = {}
+    changed = []
+    for race_key, fp in fingerprints.items():
+        cached = cache.get(fp)
+        if cached is None:
+            changed.append(race_key)
+        else:
+            results[race_key] = cached
+
+    if changed:
+        # 日付ごとに予測します（別の日の同じ 開催・R が混ざらないように）
+        for date in dict.fromkeys(k[0] for k in changed):
+            rows = df_all if date is None else df_all[df_all[DATE_COL] == date]
+            changed_index = pd.MultiIndex.from_tuples([k[1:] for k in changed if k[0] == date])
+            mask = pd.MultiIndex.from_arrays([rows['開催'], rows['Ｒ']]).isin(changed_index)
+            result_df, error_msg = logic.execute_prediction(rows[mask], bundle)
+            if error_msg:
+                return None, error_msg
+            for (place, race), race_df in result_df.groupby(['場所', 'R'], sort=False, observed=True):
+                race_key = (date, place, race)
+                race_df = race_df.reset_index(drop=True)
+                cache.put(fingerprints[race_key], race_df)
+                results[race_key] = race_df
+        # 新しい結果を書いたときに、古いキャッシュを片付けます（予測の度にキャッシュが増え続けないように）
+        cache.prune()
+
+    frames = []
+    for race_key in fingerprints:
+        if race_key not in results:
+            continue
+        race_df = results[race_key]
+        # キャッシュには日付を含めずに保存しています
+        if race_key[0] is not None:
+            race_df = race_df.drop(columns='日付', errors='ignore')
+            race_df.insert(0, '日付', race_key[0])
+        frames.append(race_df)
+    result_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    result_df.attrs['incremental'] = {'reused': len(fingerprints) - len(changed), 'rescored': len(changed)}
+    return result_df, None
@@ -0,0 +1,133 @@
+# ingest.py
+"""
+CSVの読み込みをまとめたモジュール。
+
+- 文字コードは先頭の数十KBだけを見て1回で判定します（全体を読み直して試すことはしません）
+- jra1217.csv 形式（header=None、列番号 0..）は列ごとの型を指定して読み込みます
+  （開催・騎手・種牡馬などは category、馬番・枠番・距離などは空欄を許す整数 Int64）
+- 固定幅で出力された項目の前後の空白は読み込み時に取り除きます
+- engine="pyarrow" を指定すると pyarrow のCSVエンジンを使います（インストールされている場合）
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+SNIFF_BYTES = 64 * 1024
+
+# jra1217.csv 形式の列の型（列番号 -> 型）
+CATEGORY_COLUMNS = [1, 4, 5, 8, 10, 12, 13, 14, 15, 16, 17, 20, 21]
+INT_COLUMNS = [0, 2, 3, 6, 9, 22]
+STRING_COLUMNS = [7]
+FLOAT_COLUMNS = [11]
+
+
+def sniff_encoding(source, sample_size=SNIFF_BYTES):
+    """
+    先頭 sample_size バイトから文字コード（utf-8-sig / utf-8 / cp932）を判定します。
+    source はファイルパスまたはバイナリのファイルオブジェクト（読み込み位置は元に戻します）。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            head = f.read(sample_size)
+    else:
+        pos = source.tell()
+        head = source.read(sample_size)
+        source.seek(pos)
+        if isinstance(head, str):
+            return None
+
+    if head.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    # 途中で切れた文字で誤判定しないよう、最後の改行までで判定します
+    if len(head) == sample_size and b'\n' in head:
+        head = head[:head.rindex(b'\n') + 1]
+    try:
+        head.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp932'
+
+
+def _card_dtypes(strict=True):
+    dtypes = {c: 'category' for c in CATEGORY_COLUMNS}
+    dtypes.update({c: 'string' for c in STRING_COLUMNS})
+    dtypes.update({c: 'float64' for c in FLOAT_COLUMNS})
+    if strict:
+        dtypes.update({c: 'Int64' for c in INT_COLUMNS})
+    return dtypes
+
+
+def _n_columns(source, encoding):
+    """先頭行の列数。"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding=encoding, newline='') as f:
+            line = f.readline()
+    else:
+        pos = source.tell()
+        line = source.readline()
+        source.seek(pos)
+        if isinstance(line, bytes):
+            line = line.decode(encoding, errors='replace')
+    return len(next(iter(pd.read_csv(io.StringIO(line), header=None).itertuples(index=False)), ()))
+
+
+def _strip_padding(df):
+    """文字列・カテゴリ列の前後の空白を取り除きます（カテゴリは種類ごとに1回だけ処理）。"""
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            stripped = s.cat.categories.astype(str).str.strip()
+            if stripped.equals(s.cat.categories):
+                continue
+            # 空白を除いた結果、同じ名前になるカテゴリはまとめます
+            cats, inverse = np.unique(stripped.to_numpy(dtype=object), return_inverse=True)
+            codes = s.cat.codes.to_numpy()
+            df[col] = pd.Categorical.from_codes(np.where(codes >= 0, inverse[codes], -1), cats)
+        elif pd.api.types.is_string_dtype(s.dtype):
+            df[col] = s.str.strip()
+    return df
+
+
+def _read_kwargs(source, encoding, engine, categorical, strict):
+    n_cols = _n_columns(source, encoding)
+    dtypes = {c: t for c, t in _card_dtypes(strict).items() if c < n_cols}
+    if not categorical:
+        dtypes = {c: ('string' if t == 'category' else t) for c, t in dtypes.items()}
+    kwargs = {'header': None, 'encoding': encoding, 'dtype': dtypes}
+    if engine == "pyarrow":
+        kwargs['engine'] = "pyarrow"
+    else:
+        kwargs['skipinitialspace'] = True
+    return kwargs
+
+
+def read_race_card(source, encoding=None, engine=None, categorical=True):
+    """
+    jra1217.csv 形式の出馬表を読み込みます（列名は 0, 1, 2, ... のまま）。
+    整数列は Int64 で読むので、空欄は欠損値（<NA>）になります。
+    """
+    encoding = encoding or sniff_encoding(source) or 'utf-8'
+    df = pd.read_csv(source, **_read_kwargs(source, encoding, engine, categorical, strict=True))
+    return _strip_padding(df)
+
+
+def iter_race_card(source, chunksize, encoding=None, categorical=False):
+    """
+    jra1217.csv 形式を chunksize 行ずつ読み込みます。
+    チャンクごとにカテゴリが変わらないよう、既定では category の代わりに string で読みます。
+    """
+    encoding = encoding or sniff_encoding(source) or 'utf-8'
+    kwargs = _read_kwargs(source, encoding, None, categorical, strict=False)
+    for chunk in pd.read_csv(source, chunksize=chunksize, **kwargs):
+        yield _strip_padding(chunk)
+
+
+def read_results(source, encoding=None):
+    """予測結果のCSV（ヘッダー付き、旧 data.csv）を読み込みます。無ければ None。"""
+    try:
+        encoding = encoding or sniff_encoding(source) or 'utf-8'
+        return pd.read_csv(source, encoding=encoding)
+    except FileNotFoundError:
+        return None
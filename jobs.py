@@ -0,0 +1,198 @@
+# jobs.py
+"""
+管理画面の予測をバックグラウンドで実行するジョブ管理。
+
+アップロードされたCSVは jobs/inputs/ に保存してすぐに画面へ戻り、
+予測はワーカースレッドで実行されます（保存したCSVはジョブが done/failed になった時点で削除します）。
+ジョブの状態（queued/running/done/failed）、
+レース単位の進捗（レース総数は読み終わった時点で記録）、処理時間、モデルバージョンは jobs/jobs.db（SQLite）に記録されるので、
+ブラウザが再接続しても画面から状態を確認できます。
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import incremental
+import ingest
+import stream_predict
+
+DEFAULT_DIR = "jobs"
+DB_FILE = "jobs.db"
+DEFAULT_WORKERS = 2
+# ジョブの1バッチのレース数（1会場1日分）。進捗はバッチごとに記録されるので、小さめにしておきます
+DEFAULT_MAX_RACES = 12
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT,
+    status TEXT NOT NULL,
+    model_version TEXT,
+    model_dir TEXT,
+    input_path TEXT,
+    max_races INTEGER,
+    merge INTEGER DEFAULT 0,
+    incremental INTEGER DEFAULT 0,
+    note TEXT,
+    races_total INTEGER,
+    races_done INTEGER DEFAULT 0,
+    rows INTEGER DEFAULT 0,
+    run_id TEXT,
+    error TEXT,
+    created_at REAL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+
+def _remove_input(path):
+    """ジョブの入力CSVを削除します（既に無ければ何もしません）。"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class JobQueue:
+    """予測ジョブの登録・実行・状態管理。"""
+
+    def __init__(self, store, job_dir=DEFAULT_DIR, workers=DEFAULT_WORKERS):
+        self.store = store
+        self.job_dir = job_dir
+        self.input_dir = os.path.join(job_dir, "inputs")
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.db_path = os.path.join(job_dir, DB_FILE)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="seiba-job")
+
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+        self._recover()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    def _recover(self):
+        """
+        前回のプロセスで途中だったジョブを整理します（実行中→失敗、待機中→再投入）。
+        終わったジョブの入力CSVが残っていれば削除します（待機中のジョブの分は残します）。
+        """
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ?",
+                         (FAILED, "interrupted (process restarted)", time.time(), RUNNING))
+            queued = [r['id'] for r in conn.execute("SELECT id FROM jobs WHERE status = ?", (QUEUED,))]
+            finished = [r['input_path'] for r in conn.execute(
+                "SELECT input_path FROM jobs WHERE status IN (?, ?)", (DONE, FAILED))]
+        for path in finished:
+            _remove_input(path)
+        for job_id in queued:
+            self._executor.submit(self._run, job_id)
+
+    # --- 登録 ---
+    def submit(self, data, model_dir, label="", max_races=DEFAULT_MAX_RACES, merge=False,
+               incremental=False):
+        """
+        CSVの中身(bytes)を保存してジョブを登録し、すぐに job_id を返します。
+        merge=True なら公開中の結果に、このカードのレースを追加・上書きして公開します。
+        incremental=True なら前回から変わったレースだけを予測し直し、公開中の結果に反映します。
+        """
+        model_version = os.path.basename(os.path.normpath(model_dir))
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (label, status, model_version, model_dir, max_races, merge, incremental, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (label, QUEUED, model_version, model_dir, int(max_races), int(merge), int(incremental), time.time()))
+            job_id = cur.lastrowid
+
+        input_path = os.path.join(self.input_dir, f"{job_id}.csv")
+        with open(input_path, 'wb') as f:
+            f.write(data)
+        self._update(job_id, input_path=input_path)
+
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    # --- 実行 ---
+    def _run(self, job_id):
+        job = self.get(job_id)
+        if job is None or job['status'] != QUEUED:
+            return
+        self._update(job_id, status=RUNNING, started_at=time.time())
+
+        try:
+            if job['incremental']:
+                self._run_incremental(job)
+                return
+
+            writer = self.store.begin_run(model_version=job['model_version'], merge=bool(job['merge']))
+            try:
+                summary, error_msg = stream_predict.predict_stream(
+                    job['input_path'], job['model_dir'], writer.write, max_races=job['max_races'],
+                    progress=lambda races, rows: self._update(job_id, races_done=races, rows=rows))
+            except Exception:
+                writer.abort()
+                raise
+
+            if error_msg or summary['rows'] == 0:
+                writer.abort()
+                self._update(job_id, status=FAILED, error=error_msg or "予測対象のレースがありません。",
+                             finished_at=time.time())
+                return
+
+            run_id = writer.commit()
+            self._update(job_id, status=DONE, run_id=run_id, races_total=summary['races'], finished_at=time.time())
+        except Exception as e:
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        finally:
+            # ここに来た時点でジョブは done / failed のどちらかです
+            _remove_input(job['input_path'])
+
+    def _run_incremental(self, job):
+        job_id = job['id']
+        input_df = ingest.read_race_card(job['input_path'])
+        self._update(job_id, races_total=int(input_df[[0, 1, 2]].drop_duplicates().shape[0]))
+        result_df, error_msg = incremental.predict_incremental(input_df, job['model_dir'])
+        if error_msg or result_df.empty:
+            self._update(job_id, status=FAILED, error=error_msg or "予測対象のレースがありません。",
+                         finished_at=time.time())
+            return
+
+        stats = result_df.attrs.get('incremental', {})
+        run_id = self.store.publish(result_df, model_version=job['model_version'], merge=True)
+        self._update(job_id, status=DONE, run_id=run_id, rows=len(result_df),
+                     races_done=stats.get('reused', 0) + stats.get('rescored', 0),
+                     note=f"reused {stats.get('reused', 0)} / rescored {stats.get('rescored', 0)}",
+                     finished_at=time.time())
+
+    # --- 参照 ---
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, limit=20):
+        """新しい順にジョブの一覧（画面表示用のDataFrame）を返します。"""
+        with self._connect() as conn:
+            df = pd.read_sql_query("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", conn, params=(limit,))
+        now = time.time()
+        df['elapsed'] = (df['finished_at'].fillna(now) - df['started_at']).round(1)
+        return df
+
+    def has_active(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()
+        return row[0] > 0
@@ -1,142 +1,277 @@
 # logic.py
+import numpy as np
 import pandas as pd
-import joblib
-import os
+import metrics
+import stats_index
+from model_bundle import ModelBundle, get_bundle
 
-def execute_prediction(input_df, model_dir):
+# カラム名のマッピング（jra1217.csv形式対応）
+RENAME_MAP = {
+    1: '開催', 2: 'Ｒ', 3: '馬番', 4: 'レース名',
+    5: '芝ダート', 6: '距離', 7: '馬名',
+    8: '性別', 9: '年齢', 10: '騎手',
+    12: '調教師', 15: '生産者',
+    16: '種牡馬', 20: '母父馬',
+    22: '枠番'
+}
+
+# 予測に使う特徴量（モデル学習時の並び順）
+FEATURES = ['コース枠スコア', '性別コード', '年齢', '父スコア', '母父スコア', '血統総合', '騎手スコア', '調教師スコア', '生産者スコア', 'チーム総合']
+
+SEX_CODES = {'牡': 0, '牝': 1, 'セ': 2}
+
+# 統計に存在しない名前・コース枠のスコア
+DEFAULT_SCORE = stats_index.DEFAULT_SCORE
+
+
+# ---------------------------------------------------------
+# モデルの取得
+# ---------------------------------------------------------
+def resolve_bundle(model_dir):
     """
-    受け取ったDataFrameと、指定されたモデルフォルダを使って予測を行い、
-    結果のDataFrameを返します。
+    model_dir（フォルダのパス または ModelBundle）からモデル一式を取得します。
+    戻り値は (ModelBundle, エラーメッセージ) です。
     """
-    
-    # ---------------------------------------------------------
-    # 1. モデルファイルのパス設定
-    # ---------------------------------------------------------
-    # 指定されたフォルダ(model_dir)の中にあるファイルを読みに行きます
+    if isinstance(model_dir, ModelBundle):
+        return model_dir, None
     try:
-        model = joblib.load(os.path.join(model_dir, "jra_3y_model.pkl"))
-        sire_stats = joblib.load(os.path.join(model_dir, "jra_sire_stats_3y.pkl"))
-        bms_stats = joblib.load(os.path.join(model_dir, "jra_bms_stats_3y.pkl"))
-        jockey_stats = joblib.load(os.path.join(model_dir, "jra_jockey_stats_3y.pkl"))
-        trainer_stats = joblib.load(os.path.join(model_dir, "jra_trainer_stats_3y.pkl"))
-        breeder_stats = joblib.load(os.path.join(model_dir, "jra_breeder_stats_3y.pkl"))
-        cf_stats = joblib.load(os.path.join(model_dir, "jra_course_frame_stats_3y.pkl"))
-        cf_counts = joblib.load(os.path.join(model_dir, "jra_course_frame_counts_3y.pkl"))
+        return get_bundle(model_dir), None
     except FileNotFoundError as e:
         return None, f"モデルファイルが見つかりません: {e}"
     except Exception as e:
         return None, f"モデル読み込みエラー: {e}"
 
-    # ---------------------------------------------------------
-    # 2. データの前処理
-    # ---------------------------------------------------------
+
+# ---------------------------------------------------------
+# 前処理
+# ---------------------------------------------------------
+def prepare_input(input_df):
+    """カラム名の付け替えと文字列のクリーニングを行ったコピーを返します。"""
     df_all = input_df.copy()
 
-    # カラム名のマッピング（jra1217.csv形式対応）
-    rename_map = {
-        1: '開催', 2: 'Ｒ', 3: '馬番', 4: 'レース名',
-        5: '芝ダート', 6: '距離', 7: '馬名',
-        8: '性別', 9: '年齢', 10: '騎手',
-        12: '調教師', 15: '生産者',
-        16: '種牡馬', 20: '母父馬',
-        22: '枠番'
-    }
-    
     # カラム名が番号(0,1,2...)の場合のみリネームを実行
-    if isinstance(df_all.columns[0], int) or df_all.columns[0].isdigit():
-        df_all = df_all.rename(columns=rename_map)
-    
+    if len(df_all.columns) and str(df_all.columns[0]).isdigit():
+        df_all.columns = [int(c) if str(c).isdigit() else c for c in df_all.columns]
+        df_all = df_all.rename(columns=RENAME_MAP)
+
     # 文字列のクリーニング
     if '馬名' in df_all.columns:
         df_all['馬名'] = df_all['馬名'].astype(str).str.strip()
 
+    return df_all
+
+
+def _race_first(df, col, race_ids, first_pos):
+    """各レースの先頭行の値を、全行に展開して文字列で返します。"""
+    if col not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    first = np.array([str(v) for v in df[col].to_numpy()[first_pos]], dtype=object)
+    return first[race_ids]
+
+
+def lookup_scores(stats, names, default=DEFAULT_SCORE):
+    """
+    名前の列をまとめて統計値に変換します（stats.get(name, default) の一括版）。
+    stats には Series / dict のほか、stats_index.EntityIndex も渡せます。
+    """
+    if hasattr(stats, 'lookup'):
+        return stats.lookup(names, default)
+    if not isinstance(stats, pd.Series):
+        stats = pd.Series(stats, dtype=float)
+    pos = stats.index.get_indexer(pd.Index(names))
+    values = stats.to_numpy(dtype=float)
+    return np.where(pos >= 0, values[pos], default)
+
+
+def make_course_id(track_type, distance):
+    """芝ダートと距離からコースID（例: 芝1600, ダ1200, 障3000）を作ります。"""
+    track_type = pd.Series(track_type, dtype=object).astype(str)
+    track_clean = np.where(track_type.str.contains("芝", regex=False), "芝",
+                           np.where(track_type.str.contains("ダ", regex=False), "ダ", "障"))
+    return track_clean.astype(object) + np.asarray(distance, dtype=object).astype(str)
+
+
+# ---------------------------------------------------------
+# 特徴量エンジニアリング（カード全体を一括で計算）
+# ---------------------------------------------------------
+def build_features(df_all, bundle):
+    """
+    レースごとのループを使わずに、カード全体の特徴量を計算します。
+    '_race' 列に (開催, Ｒ) の並び順でのレース番号が入ります。
+    """
+    df = df_all.dropna(subset=['開催', 'Ｒ']).copy()
+    race_ids = df.groupby(['開催', 'Ｒ'], sort=True).ngroup().to_numpy()
+    _, first_pos = np.unique(race_ids, return_index=True)
+    df['_race'] = race_ids
+
+    # レース情報の取得
+    df['_レース名'] = _race_first(df, 'レース名', race_ids, first_pos)
+    track_type = _race_first(df, '芝ダート', race_ids, first_pos)
+    distance = _race_first(df, '距離', race_ids, first_pos)
+
+    # コースID作成
+    df['コースID'] = make_course_id(track_type, distance)
+
+    df['性別コード'] = df['性別'].map(SEX_CODES).fillna(0)
+    df['年齢'] = pd.to_numeric(df['年齢'], errors='coerce').fillna(3)
+    df['枠番'] = pd.to_numeric(df['枠番'], errors='coerce').fillna(0).astype(int)
+
+    df['父スコア'] = lookup_scores(bundle.sire_stats, df['種牡馬'])
+    df['母父スコア'] = lookup_scores(bundle.bms_stats, df['母父馬'])
+    df['騎手スコア'] = lookup_scores(bundle.jockey_stats, df['騎手'])
+    df['調教師スコア'] = lookup_scores(bundle.trainer_stats, df['調教師'])
+    df['生産者スコア'] = lookup_scores(bundle.breeder_stats, df['生産者'])
+
+    # コース枠スコア
+    df['コース枠スコア'] = bundle.cf_matrix.lookup(df['コースID'], df['枠番'])
+
+    df['血統総合'] = df['父スコア'] * df['母父スコア']
+    df['チーム総合'] = df['騎手スコア'] * df['調教師スコア'] * df['生産者スコア']
+
+    for f in FEATURES:
+        df[f] = df[f].fillna(0)
+
+    return df
+
+
+def predict_scores(df, model):
+    """カード全体を1回の predict_proba で予測し、AI指数(0-100)を返します。"""
+    if df.empty:
+        return np.empty(0)
+    probs = model.predict_proba(df[FEATURES])
+    return probs[:, 1] * 100
+
+
+def rank_races(df):
+    """レース内でAI指数の高い順に並べ替え、'_rank' 列に順位を付けます。"""
+    df = df.copy()
+    df['_rank'] = df.groupby('_race')['AI指数'].rank(method='first', ascending=False, na_option='bottom').astype(int)
+    return df.sort_values(['_race', '_rank'], kind='stable')
+
+
+# ---------------------------------------------------------
+# 結果の組み立て（列単位）
+# ---------------------------------------------------------
+RESULT_COLUMNS = ['場所', 'R', 'レース名', 'AI順位', '印', '枠', '番', '馬名', '騎手', 'AI指数', '枠評', '種牡馬']
+
+# AI指数がこの値以上なら印(⭐)を付けます
+STAR_THRESHOLD = 50
+# 枠評: コース枠スコアの閾値（◎ > 0.25, ○ > 0.22, ▼ < 0.15, それ以外は -）
+WAKU_GOOD = 0.25
+WAKU_FAIR = 0.22
+WAKU_BAD = 0.15
+
+
+def make_marks(ai_index, cf_scores):
+    """AI指数とコース枠スコアの配列から 印 / 枠評 の配列を作ります。"""
+    ai_index = np.asarray(ai_index, dtype=float)
+    mark = np.where(ai_index >= STAR_THRESHOLD, "⭐", "").astype(object)
+    return mark, waku_marks(cf_scores)
+
+
+def waku_marks(cf_scores):
+    """コース枠スコアの配列から 枠評 の配列を作ります。"""
+    cf_scores = np.asarray(cf_scores, dtype=float)
+    return np.select([cf_scores > WAKU_GOOD, cf_scores > WAKU_FAIR, cf_scores < WAKU_BAD],
+                     ["◎", "○", "▼"], default="-").astype(object)
+
+
+def course_frame_table(bundle, course_id):
+    """
+    1コース分の枠番ごとのコース枠スコアと枠評を返します（予測を実行せずに表示する用）。
+    bundle には ModelBundle またはモデルフォルダのパスを渡します。
+    """
+    bundle = bundle if isinstance(bundle, ModelBundle) else get_bundle(bundle)
+    scores = bundle.cf_matrix.row(course_id)[1:]
+    return pd.DataFrame({
+        '枠': np.arange(1, len(scores) + 1),
+        'コース枠スコア': np.round(scores, 3),
+        '枠評': waku_marks(scores),
+    })
+
+
+def assemble_results(df, output="dataframe"):
+    """
+    rank_races() 済みのDataFrameから結果を列単位で組み立てます。
+    output:
+      "dataframe" ... pandas.DataFrame（既定）
+      "numpy"     ... {列名: numpy配列} の辞書
+      "arrow"     ... pyarrow.Table
+    """
+    mark, w_mark = make_marks(df['AI指数'], df['コース枠スコア'])
+    columns = {
+        '場所': df['開催'].to_numpy(),
+        'R': df['Ｒ'].to_numpy(),
+        'レース名': df['_レース名'].to_numpy(),
+        'AI順位': df['_rank'].to_numpy(),
+        '印': mark,
+        '枠': df['枠番'].to_numpy(),
+        '番': df['馬番'].to_numpy(),
+        '馬名': df['馬名'].to_numpy(),
+        '騎手': df['騎手'].to_numpy(),
+        'AI指数': np.round(df['AI指数'].to_numpy(dtype=float), 1),
+        '枠評': w_mark,
+        '種牡馬': df['種牡馬'].to_numpy(),
+    }
+
+    if output == "numpy":
+        return columns
+    if output == "arrow":
+        import pyarrow as pa
+        return pa.table({k: pa.array(v, from_pandas=True) for k, v in columns.items()})
+    if output != "dataframe":
+        raise ValueError(f"未対応の出力形式です: {output}")
+    if df.empty:
+        return pd.DataFrame()
+    return pd.DataFrame(columns, columns=RESULT_COLUMNS)
+
+
+def execute_prediction(input_df, model_dir, output="dataframe"):
+    """
+    受け取ったDataFrameと、指定されたモデルフォルダを使って予測を行い、
+    結果のDataFrameを返します。
+    model_dir にはフォルダのパスの代わりに ModelBundle を渡すこともできます。
+    output で結果の形式を選べます（assemble_results を参照）。
+    """
+
+    # ---------------------------------------------------------
+    # 1. モデルの取得
+    # ---------------------------------------------------------
+    # 指定されたフォルダ(model_dir)のモデル一式を取得します
+    # （一度読み込んだものはプロセス内で使い回されます）
+    with metrics.timer("predict_stage", stage="load"):
+        bundle, error_msg = resolve_bundle(model_dir)
+    if error_msg:
+        return None, error_msg
+
     # ---------------------------------------------------------
-    # 3. 予測計算ループ
+    # 2. データの前処理
     # ---------------------------------------------------------
-    all_results = []
-    
+    with metrics.timer("predict_stage", stage="rename_clean"):
+        df_all = prepare_input(input_df)
+
     if '開催' not in df_all.columns or 'Ｒ' not in df_all.columns:
          return None, "CSVの形式が正しくありません（開催・R列不足）"
 
-    grouped = df_all.groupby(['開催', 'Ｒ'])
-
-    for (place, race_num), df in grouped:
-        # レース情報の取得
-        race_name = str(df['レース名'].iloc[0]) if 'レース名' in df.columns else ""
-        track_type = str(df['芝ダート'].iloc[0]) if '芝ダート' in df.columns else ""
-        distance = str(df['距離'].iloc[0]) if '距離' in df.columns else ""
-        
-        # コースID作成
-        track_clean = "芝" if "芝" in track_type else ("ダ" if "ダ" in track_type else "障")
-        COURSE_ID = f"{track_clean}{distance}"
-        
-        # 特徴量エンジニアリング
-        df['性別コード'] = df['性別'].map({'牡': 0, '牝': 1, 'セ': 2}).fillna(0)
-        df['年齢'] = pd.to_numeric(df['年齢'], errors='coerce').fillna(3)
-        df['枠番'] = pd.to_numeric(df['枠番'], errors='coerce').fillna(0).astype(int)
-
-        # スコア取得関数
-        def get_score(name, stats): return stats.get(name, 0.2)
-
-        df['父スコア'] = df['種牡馬'].apply(lambda x: get_score(x, sire_stats))
-        df['母父スコア'] = df['母父馬'].apply(lambda x: get_score(x, bms_stats))
-        df['騎手スコア'] = df['騎手'].apply(lambda x: get_score(x, jockey_stats))
-        df['調教師スコア'] = df['調教師'].apply(lambda x: get_score(x, trainer_stats))
-        df['生産者スコア'] = df['生産者'].apply(lambda x: get_score(x, breeder_stats))
-        
-        # コース枠スコア
-        def get_cf_score(waku):
-            try:
-                count = cf_counts.loc[(COURSE_ID, waku)]
-                if count < 5: return 0.2
-                return cf_stats.loc[(COURSE_ID, waku)]
-            except: return 0.2
-
-        df['コース枠スコア'] = df['枠番'].apply(get_cf_score)
-
-        df['血統総合'] = df['父スコア'] * df['母父スコア']
-        df['チーム総合'] = df['騎手スコア'] * df['調教師スコア'] * df['生産者スコア']
-
-        # 予測に必要なカラムを準備
-        features = ['コース枠スコア', '性別コード', '年齢', '父スコア', '母父スコア', '血統総合', '騎手スコア', '調教師スコア', '生産者スコア', 'チーム総合']
-        for f in features: 
-            if f not in df.columns: df[f] = 0
-            df[f] = df[f].fillna(0)
-
-        # AI予測実行
-        probs = model.predict_proba(df[features])
-        df['AI指数'] = [p[1] * 100 for p in probs]
-
-        # 順位付け
-        df = df.sort_values('AI指数', ascending=False)
-        
-        # 整形してリストに追加
-        rank = 1
-        for _, r in df.iterrows():
-            mark = "⭐" if r['AI指数'] >= 50 else ""
-            
-            w_val = r['コース枠スコア']
-            if w_val > 0.25: w_mark = "◎"
-            elif w_val > 0.22: w_mark = "○"
-            elif w_val < 0.15: w_mark = "▼"
-            else: w_mark = "-"
-
-            all_results.append({
-                '場所': place,
-                'R': race_num,
-                'レース名': race_name,
-                'AI順位': rank,
-                '印': mark,
-                '枠': r['枠番'],
-                '番': r['馬番'],
-                '馬名': r['馬名'],
-                '騎手': r['騎手'],
-                'AI指数': round(r['AI指数'], 1),
-                '枠評': w_mark,
-                '種牡馬': r['種牡馬']
-            })
-            rank += 1
-
-    # 結果をDataFrame化
-    result_df = pd.DataFrame(all_results)
-    return result_df, None
+    # ---------------------------------------------------------
+    # 3. 特徴量・予測・順位付け（カード全体を一括処理）
+    # ---------------------------------------------------------
+    with metrics.timer("predict_stage", stage="features"):
+        df = build_features(df_all, bundle)
+    with metrics.timer("predict_stage", stage="inference"):
+        df['AI指数'] = predict_scores(df, bundle.model)
+    with metrics.timer("predict_stage", stage="rank"):
+        df = rank_races(df)
+
+    # ---------------------------------------------------------
+    # 4. 結果の整形
+    # ---------------------------------------------------------
+    try:
+        with metrics.timer("predict_stage", stage="assembly"):
+            result = assemble_results(df, output=output)
+    except ImportError as e:
+        return None, f"出力形式 {output} に必要なライブラリがありません: {e}"
+
+    metrics.count("predictions", model=bundle.version)
+    metrics.count("predicted_rows", len(df), model=bundle.version)
+    return result, None
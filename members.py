@@ -0,0 +1,152 @@
+# members.py
+"""
+会員（Supabase の users テーブル）へのアクセスをまとめたモジュール。
+
+- HTTPクライアントはプロセスで1つを使い回します（接続を毎回張り直しません）
+- 承認待ち・有効会員の一覧は TTL 付きでキャッシュし、書き込み時に破棄します
+- 承認・却下は複数人をまとめて1回のリクエストで行えます
+
+Supabase の REST API（PostgREST）を直接呼び出すので、
+rest_url にローカルの PostgREST やスタブを指定してテストできます。
+"""
+import os
+import threading
+import time
+
+import httpx
+
+import metrics
+
+TABLE = "users"
+# 会員一覧のキャッシュ時間（秒）
+DEFAULT_TTL = 30
+DEFAULT_TIMEOUT = 10
+
+
+def _in_filter(ids):
+    """PostgREST の in.(...) フィルタ。id は整数・UUID のどちらでもよいよう、そのまま引用符で囲みます。"""
+    quoted = ('"' + str(i).replace('\\', '\\\\').replace('"', '\\"') + '"' for i in ids)
+    return "in.(" + ",".join(quoted) + ")"
+
+
+class MemberRepository:
+    """users テーブルの読み書き。"""
+
+    def __init__(self, rest_url, api_key=None, client=None, ttl=DEFAULT_TTL):
+        self.rest_url = rest_url.rstrip("/")
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers.update({"apikey": api_key, "Authorization": f"Bearer {api_key}"})
+        # 外から渡された client にも認証ヘッダーが付くよう、ヘッダーはリクエストごとに渡します
+        self.headers = headers
+        self.client = client or httpx.Client(timeout=DEFAULT_TIMEOUT)
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """SUPABASE_URL / SUPABASE_KEY から作ります（未設定なら None）。"""
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_KEY")
+        if not url or not key:
+            return None
+        return cls(f"{url.rstrip('/')}/rest/v1", key)
+
+    # --- HTTP ---
+    def _request(self, method, op, params=None, json=None, prefer=None):
+        headers = dict(self.headers, Prefer=prefer) if prefer else self.headers
+        with metrics.timer("supabase_query", table=TABLE, op=op):
+            res = self.client.request(method, f"{self.rest_url}/{TABLE}", params=params, json=json, headers=headers)
+        res.raise_for_status()
+        return res.json() if res.content else []
+
+    # --- キャッシュ ---
+    def _cached(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None and now - hit[0] < self.ttl:
+                return hit[1]
+        value = loader()
+        with self._lock:
+            self._cache[key] = (now, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    # --- 認証・登録 ---
+    def authenticate(self, username, password):
+        """ユーザー名とパスワードが一致する会員を返します（無ければ None）。"""
+        rows = self._request("GET", "login", params={
+            "select": "*", "username": f"eq.{username}", "password": f"eq.{password}", "limit": 1})
+        return rows[0] if rows else None
+
+    def register(self, username, password):
+        """
+        承認待ちの会員として登録します。
+        登録できれば True、ユーザー名が使用済みなら False を返します。
+        """
+        rows = self._request("GET", "register_check", params={
+            "select": "id", "username": f"eq.{username}", "limit": 1})
+        if rows:
+            return False
+        self._request("POST", "register_insert", json={
+            "username": username,
+            "password": password,
+            "status": "pending",
+            "role": "member",
+        }, prefer="return=minimal")
+        self.invalidate()
+        return True
+
+    # --- 管理者用 ---
+    def list_pending(self):
+        return self._cached("pending", lambda: self._request("GET", "list_pending", params={
+            "select": "*", "status": "eq.pending", "order": "id"}))
+
+    def list_active(self):
+        return self._cached("active", lambda: self._request("GET", "list_active", params={
+            "select": "*", "status": "eq.approved", "role": "neq.admin", "order": "id"}))
+
+    def approve(self, ids):
+        """指定した会員をまとめて承認します（1回のリクエスト）。"""
+        ids = list(ids)
+        if not ids:
+            return
+        self._request("PATCH", "approve", params={"id": _in_filter(ids)},
+                      json={"status": "approved"}, prefer="return=minimal")
+        self.invalidate()
+
+    def delete(self, ids, op="reject"):
+        """指定した会員をまとめて削除します（却下・会員削除、1回のリクエスト）。"""
+        ids = list(ids)
+        if not ids:
+            return
+        self._request("DELETE", op, params={"id": _in_filter(ids)}, prefer="return=minimal")
+        self.invalidate()
+
+    def reject(self, ids):
+        self.delete(ids, op="reject")
+
+    def remove(self, ids):
+        self.delete(ids, op="remove")
+
+
+# ---------------------------------------------------------
+# プロセス共通のインスタンス
+# ---------------------------------------------------------
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """環境変数から作った MemberRepository を返します（プロセスで1つ、未設定なら None）。"""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = MemberRepository.from_env()
+    return _repository
@@ -0,0 +1,241 @@
+# metrics.py
+"""
+処理時間・件数の簡易計測。既定では無効で、無効時はほぼ何もしません。
+
+環境変数:
+  SEIBA_METRICS=1            計測を有効にする
+  SEIBA_METRICS_LOG=path     計測1回ごとにJSONを1行ずつ追記する
+                             （未指定ならロガー "seiba.metrics" に INFO で出力。ハンドラーが無ければ標準エラーに出します）
+  SEIBA_METRICS_FILE=path    Prometheus形式のテキストを書き出すファイル（node_exporter の textfile 用）
+  SEIBA_METRICS_PORT=9108    Prometheus形式のテキストを返すHTTPサーバーのポート
+
+使い方:
+    with metrics.timer("predict_stage", stage="features"):
+        ...
+    metrics.count("predictions", model="v1")
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.environ.get("SEIBA_METRICS", "") not in ("", "0")
+PREFIX = "seiba_"
+
+logger = logging.getLogger("seiba.metrics")
+
+_lock = threading.Lock()
+# (名前, ラベル) -> [回数, 合計秒, 最大秒]
+_timers = {}
+# (名前, ラベル) -> 値
+_counters = {}
+_log_file = None
+_logger_ready = False
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _setup_logger():
+    """ロガーを INFO にし、どこにもハンドラーが無ければ標準エラーへのハンドラーを付けます。"""
+    global _logger_ready
+    with _lock:
+        if _logger_ready:
+            return
+        logger.setLevel(logging.INFO)
+        if not logger.hasHandlers():
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        _logger_ready = True
+
+
+def _emit(record):
+    global _log_file
+    path = os.environ.get("SEIBA_METRICS_LOG")
+    line = json.dumps(record, ensure_ascii=False)
+    if not path:
+        if not _logger_ready:
+            _setup_logger()
+        logger.info(line)
+        return
+    with _lock:
+        if _log_file is None or _log_file.name != path:
+            _log_file = open(path, 'a', encoding='utf-8')
+        _log_file.write(line + "\n")
+        _log_file.flush()
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, error=exc_type is not None, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def timer(name, **labels):
+    """with 文で囲んだ処理の時間を記録します。"""
+    return _Timer(name, labels) if ENABLED else _NOOP
+
+
+def observe(name, seconds, error=False, **labels):
+    """計測済みの時間を記録します。"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        stat = _timers.setdefault(key, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+    record = {'ts': time.time(), 'metric': name, 'seconds': round(seconds, 6), **labels}
+    if error:
+        record['error'] = True
+    _emit(record)
+
+
+def count(name, value=1, **labels):
+    """件数を加算します。"""
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def snapshot():
+    """現在の集計を dict で返します。"""
+    with _lock:
+        timers = [{'metric': n, **dict(l), 'count': c, 'sum': s, 'max': m} for (n, l), (c, s, m) in _timers.items()]
+        counters = [{'metric': n, **dict(l), 'value': v} for (n, l), v in _counters.items()]
+    return {'timers': timers, 'counters': counters}
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+# ---------------------------------------------------------
+# Prometheus 形式の出力
+# ---------------------------------------------------------
+def _labels_text(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        timers = sorted(_timers.items())
+        counters = sorted(_counters.items())
+
+    seen = set()
+    for (name, labels), (c, s, m) in timers:
+        metric = f"{PREFIX}{name}_seconds"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} summary")
+            seen.add(metric)
+        lab = _labels_text(labels)
+        lines.append(f"{metric}_count{lab} {c}")
+        lines.append(f"{metric}_sum{lab} {s:.6f}")
+
+    for (name, labels), (c, s, m) in timers:
+        metric = f"{PREFIX}{name}_max_seconds"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} gauge")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {m:.6f}")
+
+    for (name, labels), v in counters:
+        metric = f"{PREFIX}{name}_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {v}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=None):
+    """
+    Prometheus形式のテキストをファイルに書き出します（path 未指定なら SEIBA_METRICS_FILE）。
+    予測結果の公開などの後に呼ばれるため、書き出しに失敗しても例外は出さずにログに残すだけにします。
+    """
+    path = path or os.environ.get("SEIBA_METRICS_FILE")
+    if not ENABLED or not path:
+        return
+    # 同時に呼ばれても一時ファイルが重ならないよう、プロセス・スレッドごとの名前にします
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(render_prometheus())
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("metrics file export failed: %s", e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=None, host="127.0.0.1"):
+    """
+    /metrics 用のHTTPサーバーをバックグラウンドで起動します（port 未指定なら SEIBA_METRICS_PORT）。
+    計測が無効、またはポート指定が無ければ何もしません。
+    """
+    port = port or os.environ.get("SEIBA_METRICS_PORT")
+    if not ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer((host, int(port)), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="seiba-metrics").start()
+    return server
@@ -0,0 +1,189 @@
+# model_bundle.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+
+import stats_index
+
+# ---------------------------------------------------------
+# モデルフォルダ(models/<ver>/)の構成
+# ---------------------------------------------------------
+MODEL_FILE = "jra_3y_model.pkl"
+
+STATS_FILES = {
+    'sire_stats': "jra_sire_stats_3y.pkl",
+    'bms_stats': "jra_bms_stats_3y.pkl",
+    'jockey_stats': "jra_jockey_stats_3y.pkl",
+    'trainer_stats': "jra_trainer_stats_3y.pkl",
+    'breeder_stats': "jra_breeder_stats_3y.pkl",
+    'cf_stats': "jra_course_frame_stats_3y.pkl",
+    'cf_counts': "jra_course_frame_counts_3y.pkl",
+}
+
+# ファイルのサイズと sha256 の記録（model_registry が書き出します）
+MANIFEST_FILE = "manifest.json"
+
+REQUIRED_FILES = [MODEL_FILE] + list(STATS_FILES.values())
+
+# 同時にメモリに置いておくモデルバージョンの数（古いものから捨てます）
+MAX_CACHED_BUNDLES = int(os.environ.get("SEIBA_MODEL_CACHE_SIZE", "2"))
+
+
+class ModelBundle:
+    """
+    1つのモデルバージョン（models/<ver>/ の中身一式）をまとめて保持します。
+    直接作らずに get_bundle() 経由で取得してください。
+    """
+
+    def __init__(self, model_dir, model, stats, signature):
+        self.model_dir = model_dir
+        self.model = model
+        self.signature = signature
+        self.sire_stats = stats['sire_stats']
+        self.bms_stats = stats['bms_stats']
+        self.jockey_stats = stats['jockey_stats']
+        self.trainer_stats = stats['trainer_stats']
+        self.breeder_stats = stats['breeder_stats']
+        self.cf_stats = stats['cf_stats']
+        self.cf_counts = stats['cf_counts']
+        # (コース × 枠番) のスコア行列（index/ に無ければここで作ります）
+        self.cf_matrix = stats.get('cf_matrix')
+        if self.cf_matrix is None:
+            self.cf_matrix = stats_index.CourseFrameMatrix.from_stats(self.cf_stats, self.cf_counts)
+
+    @property
+    def version(self):
+        return os.path.basename(self.model_dir.rstrip(os.sep))
+
+    @classmethod
+    def load(cls, model_dir):
+        """
+        キャッシュを使わずにフォルダから読み込みます。
+        index/（stats_index.py で作成）が最新なら、名前の統計は pickle の代わりにそちらを使います。
+        manifest.json があれば、読み込む前にファイルのサイズが一致するかを確認します（不一致なら ValueError）。
+        （ハッシュ・特徴量の確認は model_registry が一覧を作るときに1回だけ行います）
+        """
+        signature = file_signature(model_dir)
+        problems = check_files(model_dir, check_hashes=False)
+        if problems:
+            raise ValueError("モデルフォルダが壊れています: " + " / ".join(problems))
+        model = joblib.load(os.path.join(model_dir, MODEL_FILE))
+        stats = stats_index.load_indexes(model_dir) or {}
+        for key, fname in STATS_FILES.items():
+            if key not in stats:
+                stats[key] = joblib.load(os.path.join(model_dir, fname))
+        return cls(model_dir, model, stats, signature)
+
+    def __repr__(self):
+        return f"ModelBundle({self.model_dir!r})"
+
+
+def file_signature(model_dir):
+    """
+    フォルダ内の必須ファイルの (ファイル名, 更新時刻, サイズ) を返します。
+    ファイルが1つでも欠けていれば FileNotFoundError になります。
+    """
+    signature = []
+    for fname in REQUIRED_FILES:
+        st = os.stat(os.path.join(model_dir, fname))
+        signature.append((fname, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+# ---------------------------------------------------------
+# manifest.json との照合
+# ---------------------------------------------------------
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(model_dir):
+    """manifest.json の中身（無ければ None）。"""
+    try:
+        with open(os.path.join(model_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def check_files(model_dir, check_hashes=True):
+    """
+    必須ファイルがそろっているか、manifest.json の記録とサイズ（check_hashes=True なら sha256 も）が
+    一致するかを確認し、問題点のリストを返します。manifest が無ければファイルの有無だけを見ます。
+    """
+    problems = [f"{fname} がありません" for fname in REQUIRED_FILES
+                if not os.path.isfile(os.path.join(model_dir, fname))]
+    if problems:
+        return problems
+
+    try:
+        manifest = read_manifest(model_dir)
+    except ValueError as e:
+        return [f"{MANIFEST_FILE} を読めません: {e}"]
+    if manifest is None:
+        return []
+
+    for fname, info in manifest.get('files', {}).items():
+        path = os.path.join(model_dir, fname)
+        if not os.path.isfile(path):
+            problems.append(f"{fname} がありません")
+        elif os.path.getsize(path) != info.get('size'):
+            problems.append(f"{fname} のサイズが manifest と一致しません")
+        elif check_hashes and file_sha256(path) != info.get('sha256'):
+            problems.append(f"{fname} のハッシュが manifest と一致しません")
+    return problems
+
+
+# ---------------------------------------------------------
+# プロセス共通のキャッシュ（LRU）
+# ---------------------------------------------------------
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_bundle(model_dir):
+    """
+    指定フォルダのモデル一式を返します。
+    一度読み込んだものはプロセス内で使い回し、ファイルが更新されていれば読み直します。
+    """
+    key = os.path.abspath(model_dir)
+    with _lock:
+        signature = file_signature(key)
+        bundle = _cache.get(key)
+        if bundle is not None and bundle.signature == signature:
+            _cache.move_to_end(key)
+            return bundle
+
+        bundle = ModelBundle.load(key)
+        _cache[key] = bundle
+        _cache.move_to_end(key)
+        while len(_cache) > max(MAX_CACHED_BUNDLES, 1):
+            _cache.popitem(last=False)
+        return bundle
+
+
+def warm_up(model_dirs):
+    """
+    起動時に呼び出して、指定フォルダのモデルを先に読み込んでおきます。
+    読み込めなかったフォルダは {フォルダ: エラーメッセージ} で返します。
+    """
+    errors = {}
+    for model_dir in model_dirs:
+        try:
+            get_bundle(model_dir)
+        except Exception as e:
+            errors[model_dir] = str(e)
+    return errors
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,228 @@
+# model_registry.py
+"""
+models/ 内のモデルバージョンの一覧と検証。
+
+models/<ver>/manifest.json には、各ファイルのサイズと sha256、モデルが学習した特徴量、入力CSVの列を記録します。
+特徴量はモデル本体（feature_names_in_ / n_features_in_）から取り出すので、
+現在のコードが作る特徴量（logic.FEATURES）と違う特徴量で学習したモデルや、入力CSVの列（logic.RENAME_MAP）が
+違うバージョンは使えません。
+
+    python model_registry.py models/v2      # manifest.json を書き出す（既存のフォルダ用）
+
+ModelRegistry はフォルダを1回だけ検証して結果を覚えておき、フォルダやファイルが変わったときだけ検証し直します。
+models/ の更新時刻が変わらない間は、一覧を作り直さずに前回の結果を返します（RECHECK_SECONDS ごとには確認し直します）。
+必須ファイルが欠けている・manifest と中身が違うバージョンは、読み込む前に「使えない」と判定されます。
+manifest が無いバージョンは、必須ファイルがそろっていれば使えるものとして扱います（verified=False）。
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import joblib
+
+import logic
+from model_bundle import MANIFEST_FILE, MODEL_FILE, REQUIRED_FILES, check_files, file_sha256, read_manifest
+
+MANIFEST_VERSION = 1
+DEFAULT_MODELS_DIR = "models"
+# models/ の更新時刻が変わらなくても、中のファイルを確認し直す間隔（秒）
+RECHECK_SECONDS = 60
+
+
+# ---------------------------------------------------------
+# manifest
+# ---------------------------------------------------------
+def _input_columns():
+    """入力CSVの列（列番号 -> 列名、JSON のキーに合わせて列番号は文字列）。"""
+    return {str(k): v for k, v in logic.RENAME_MAP.items()}
+
+
+def model_features(model):
+    """
+    学習済みモデルの特徴量 (名前のリスト, 数) を返します。
+    DataFrame で学習していないモデルは名前が None、どちらも分からなければ (None, None) です。
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    n_features = getattr(model, 'n_features_in_', None)
+    return (None if names is None else [str(n) for n in names],
+            None if n_features is None else int(n_features))
+
+
+def make_manifest(model_dir, extra=None):
+    """フォルダの必須ファイルから manifest の dict を作ります（ファイルが欠けていれば FileNotFoundError）。"""
+    files = {}
+    for fname in REQUIRED_FILES:
+        path = os.path.join(model_dir, fname)
+        files[fname] = {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+    features, n_features = model_features(joblib.load(os.path.join(model_dir, MODEL_FILE)))
+    manifest = {
+        'manifest_version': MANIFEST_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'files': files,
+        'features': features,
+        'n_features': n_features,
+        'input_columns': _input_columns(),
+    }
+    if extra:
+        manifest.update(extra)
+    return manifest
+
+
+def write_manifest(model_dir, extra=None):
+    manifest = make_manifest(model_dir, extra)
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def verify(model_dir, check_hashes=True):
+    """
+    フォルダを検証し、問題点のリストを返します（空なら使えます）。
+    ファイルと manifest の照合（model_bundle.check_files）に加えて、モデルの特徴量と入力CSVの列が
+    現在のコードと合っているかを確認します。check_hashes=False ならファイルはサイズだけを比べます。
+    """
+    problems = check_files(model_dir, check_hashes)
+    try:
+        manifest = read_manifest(model_dir)
+    except ValueError:
+        return problems
+    if manifest is None:
+        return problems
+
+    features, n_features = manifest.get('features'), manifest.get('n_features')
+    if features is not None and features != list(logic.FEATURES):
+        problems.append("モデルの特徴量が現在のコードと一致しません")
+    elif n_features is not None and n_features != len(logic.FEATURES):
+        problems.append(f"モデルの特徴量の数（{n_features}）が現在のコード（{len(logic.FEATURES)}）と一致しません")
+    if manifest.get('input_columns') != _input_columns():
+        problems.append("入力CSVの列が現在のコードと一致しません")
+    return problems
+
+
+# ---------------------------------------------------------
+# バージョン一覧
+# ---------------------------------------------------------
+def _stat_key(model_dir):
+    """フォルダと中のファイルの更新状況（変わったときだけ検証し直すためのキー）。"""
+    key = [os.stat(model_dir).st_mtime_ns]
+    for fname in REQUIRED_FILES + [MANIFEST_FILE]:
+        try:
+            st = os.stat(os.path.join(model_dir, fname))
+            key.append((fname, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            key.append((fname, None))
+    return tuple(key)
+
+
+class ModelRegistry:
+    """
+    models/ 内のバージョンの検証結果を保持します。
+    versions() の各要素: {'name', 'path', 'ok', 'verified', 'problems', 'manifest'}
+    """
+
+    def __init__(self, models_dir=DEFAULT_MODELS_DIR):
+        self.models_dir = models_dir
+        self._entries = {}
+        self._infos = None
+        self._dir_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _names(self):
+        if not os.path.isdir(self.models_dir):
+            return []
+        return sorted(d for d in os.listdir(self.models_dir)
+                      if not d.startswith(".") and os.path.isdir(os.path.join(self.models_dir, d)))
+
+    def versions(self):
+        """全バージョンの検証結果（名前順）。変わっていないバージョンは前回の結果を使います。"""
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.models_dir).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime = None
+            now = time.monotonic()
+            if self._infos is not None and dir_mtime == self._dir_mtime and now - self._checked_at < RECHECK_SECONDS:
+                return list(self._infos)
+
+            entries = {}
+            for name in self._names():
+                path = os.path.join(self.models_dir, name)
+                try:
+                    key = _stat_key(path)
+                except FileNotFoundError:
+                    continue
+                entry = self._entries.get(name)
+                if entry is None or entry['key'] != key:
+                    entry = self._check(name, path, key)
+                entries[name] = entry
+            self._entries = entries
+            self._infos = [e['info'] for e in entries.values()]
+            self._dir_mtime, self._checked_at = dir_mtime, now
+            return list(self._infos)
+
+    def _check(self, name, path, key):
+        problems = verify(path)
+        try:
+            manifest = read_manifest(path)
+        except ValueError:
+            manifest = None
+        info = {
+            'name': name,
+            'path': path,
+            'ok': not problems,
+            'verified': manifest is not None and not problems,
+            'problems': problems,
+            'manifest': manifest,
+        }
+        return {'key': key, 'info': info}
+
+    def split(self):
+        """1回の一覧から (使えるバージョンの名前一覧, 使えないバージョンの {名前: 問題点のリスト}) を返します。"""
+        versions = self.versions()
+        return ([v['name'] for v in versions if v['ok']],
+                {v['name']: v['problems'] for v in versions if not v['ok']})
+
+    def good_versions(self):
+        """使えるバージョンの名前一覧。"""
+        return self.split()[0]
+
+    def broken_versions(self):
+        """使えないバージョンの {名前: 問題点のリスト}。"""
+        return self.split()[1]
+
+    def path(self, name):
+        return os.path.join(self.models_dir, name)
+
+
+# ---------------------------------------------------------
+# プロセス共通のインスタンス
+# ---------------------------------------------------------
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(models_dir=DEFAULT_MODELS_DIR):
+    key = os.path.abspath(models_dir)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = ModelRegistry(models_dir)
+        return _registries[key]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="モデルフォルダの manifest.json を書き出します")
+    parser.add_argument("model_dirs", nargs="+", help="models/<ver> フォルダ")
+    args = parser.parse_args()
+    for model_dir in args.model_dirs:
+        missing = [f for f in REQUIRED_FILES if not os.path.isfile(os.path.join(model_dir, f))]
+        if missing:
+            print(f"{model_dir}: " + " / ".join(f"{f} がありません" for f in missing))
+            continue
+        print(f"{model_dir} -> {write_manifest(model_dir)}")
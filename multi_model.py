@@ -0,0 +1,107 @@
+# multi_model.py
+"""
+1つの出馬表を複数のモデルバージョンで同時に予測し、横並びで比較します。
+各バージョンはプロセスプールの別プロセスで予測され、
+それぞれのプロセスがモデル一式（ModelBundle）を保持して使い回します。
+"""
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import logic
+
+# 馬を特定するキー
+KEY_COLUMNS = ['場所', 'R', '番']
+# 比較表に残す共通の列
+INFO_COLUMNS = ['場所', 'R', 'レース名', '枠', '番', '馬名', '騎手']
+
+_executor = None
+_executor_workers = 0
+
+
+def _get_executor(workers):
+    """
+    プロセスプールを使い回します（ワーカー側のモデルキャッシュを活かすため）。
+    fork だと親のスレッドが持っているロック（model_bundle のキャッシュなど）ごと複製されて
+    止まることがあるため、ワーカーは spawn で起動します。
+    """
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers < workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _executor_workers = workers
+    return _executor
+
+
+@atexit.register
+def _shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _predict_worker(input_df, model_dir):
+    # ワーカープロセス内では model_bundle のキャッシュにより2回目以降は読み込み不要
+    return logic.execute_prediction(input_df, model_dir)
+
+
+def version_name(model_dir):
+    return os.path.basename(os.path.normpath(model_dir))
+
+
+def run_versions(input_df, model_dirs, max_workers=None):
+    """
+    各モデルフォルダで並列に予測します。
+    戻り値: ({バージョン名: 結果DataFrame}, {バージョン名: エラーメッセージ})
+    """
+    workers = max_workers or min(len(model_dirs), os.cpu_count() or 1)
+    executor = _get_executor(max(workers, 1))
+    futures = {version_name(d): executor.submit(_predict_worker, input_df, d) for d in model_dirs}
+
+    results, errors = {}, {}
+    for ver, future in futures.items():
+        try:
+            result_df, error_msg = future.result()
+        except Exception as e:
+            result_df, error_msg = None, f"予測エラー: {e}"
+        if error_msg:
+            errors[ver] = error_msg
+        else:
+            results[ver] = result_df
+    return results, errors
+
+
+def merge_results(results, base_version=None):
+    """
+    バージョンごとの結果を1つの表にまとめます。
+    列: 共通情報 + AI指数_<ver> / AI順位_<ver>、基準以外は 順位差_<ver>（基準との差、マイナスは上昇）
+    """
+    if not results:
+        return None
+    versions = list(results)
+    base_version = base_version if base_version in results else versions[0]
+
+    merged = None
+    for ver in [base_version] + [v for v in versions if v != base_version]:
+        df = results[ver]
+        part = df[[c for c in INFO_COLUMNS if c in df.columns]] if merged is None else df[KEY_COLUMNS]
+        part = part.assign(**{f'AI指数_{ver}': df['AI指数'], f'AI順位_{ver}': df['AI順位']})
+        merged = part if merged is None else merged.merge(part, on=KEY_COLUMNS, how='outer')
+
+    for ver in versions:
+        if ver != base_version:
+            merged[f'順位差_{ver}'] = merged[f'AI順位_{ver}'] - merged[f'AI順位_{base_version}']
+
+    return merged.sort_values(['場所', 'R', f'AI順位_{base_version}'], kind='stable').reset_index(drop=True)
+
+
+def compare_versions(input_df, model_dirs, base_version=None, max_workers=None):
+    """
+    複数バージョンで予測して比較表を返します。
+    戻り値: (比較DataFrame, {バージョン名: エラーメッセージ})
+    """
+    results, errors = run_versions(input_df, model_dirs, max_workers)
+    return merge_results(results, base_version), errors
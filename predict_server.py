@@ -0,0 +1,260 @@
+# predict_server.py
+"""
+Streamlit を使わずに予測を実行するローカルHTTPサーバー。
+
+    python predict_server.py --model-dir models/v1 --port 8765
+
+モデル一式はプロセス内に読み込んだまま使い回し（ファイルが更新されれば読み直します）、
+同時に届いたリクエストは数ミリ秒だけ待ってまとめ、1回の predict_proba で予測します。
+
+  POST /predict   出馬表（jra1217.csv 形式）を本文で送ると、順位付きの予測結果を返します
+                  本文: CSV（Content-Type: text/csv）または Arrow IPC ストリーム
+                        （Content-Type: application/vnd.apache.arrow.stream）
+                  結果の形式: ?format=json（既定）/ csv / arrow
+  GET  /health    モデルバージョンと処理件数
+
+例:
+    curl -s --data-binary @jra1217.csv -H "Content-Type: text/csv" "http://127.0.0.1:8765/predict?format=csv"
+"""
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import logic
+import metrics
+from model_bundle import get_bundle
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# 最初のリクエストが届いてから、まとめる相手を待つ時間（ミリ秒）
+DEFAULT_MAX_WAIT_MS = 5
+# 1回の predict_proba にまとめる最大行数
+DEFAULT_MAX_BATCH_ROWS = 50000
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+CONTENT_TYPES = {
+    'json': "application/json; charset=utf-8",
+    'csv': "text/csv; charset=utf-8",
+    'arrow': ARROW_TYPE,
+}
+
+
+# ---------------------------------------------------------
+# マイクロバッチ
+# ---------------------------------------------------------
+class MicroBatcher:
+    """
+    特徴量を作ったカードを受け取り、同時に届いたものをまとめて予測します。
+    submit() は AI指数の配列を返す Future を返します。
+    """
+
+    def __init__(self, max_wait_ms=DEFAULT_MAX_WAIT_MS, max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_rows = max_batch_rows
+        self.batches = 0
+        self.cards = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="seiba-batcher")
+        self._thread.start()
+
+    def submit(self, bundle, features):
+        future = Future()
+        self._queue.put((bundle, features, future))
+        return future
+
+    def _collect(self):
+        """最初の1件を待ち、max_wait の間に届いたものを max_batch_rows まで追加します。"""
+        items = [self._queue.get()]
+        rows = len(items[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            rows += len(item[1])
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            # モデルが更新された直後などは、同じモデルのものだけをまとめます
+            groups = {}
+            for item in items:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                self._predict(group)
+
+    def _predict(self, items):
+        bundle = items[0][0]
+        try:
+            with metrics.timer("server_stage", stage="inference"):
+                features = pd.concat([f[logic.FEATURES] for _, f, _ in items], ignore_index=True)
+                scores = logic.predict_scores(features, bundle.model)
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.cards += len(items)
+        metrics.count("server_batches", model=bundle.version)
+        offsets = np.cumsum([0] + [len(f) for _, f, _ in items])
+        for (_, _, future), start, end in zip(items, offsets[:-1], offsets[1:]):
+            future.set_result(scores[start:end])
+
+
+# ---------------------------------------------------------
+# 予測（リクエストごと）
+# ---------------------------------------------------------
+class PredictionService:
+    """モデルフォルダ1つ分の予測。特徴量・順位付けはリクエストのスレッドで行います。"""
+
+    def __init__(self, model_dir, batcher=None):
+        self.model_dir = model_dir
+        self.batcher = batcher or MicroBatcher()
+        self.bundle = get_bundle(model_dir)
+        self.requests = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def predict(self, input_df, output="dataframe"):
+        """execute_prediction と同じく (結果, エラーメッセージ) を返します。"""
+        try:
+            bundle = get_bundle(self.model_dir)
+        except Exception as e:
+            return None, f"モデル読み込みエラー: {e}"
+        self.bundle = bundle
+
+        df_all = logic.prepare_input(input_df)
+        if '開催' not in df_all.columns or 'Ｒ' not in df_all.columns:
+            return None, "CSVの形式が正しくありません（開催・R列不足）"
+
+        with metrics.timer("server_stage", stage="features"):
+            df = logic.build_features(df_all, bundle)
+        if df.empty:
+            return None, "予測対象のレースがありません。"
+        df['AI指数'] = self.batcher.submit(bundle, df).result()
+
+        with metrics.timer("server_stage", stage="assembly"):
+            result = logic.assemble_results(logic.rank_races(df), output=output)
+        with self._lock:
+            self.requests += 1
+            self.rows += len(df)
+        return result, None
+
+    def health(self):
+        return {
+            'model_version': self.bundle.version,
+            'requests': self.requests,
+            'rows': self.rows,
+            'batches': self.batcher.batches,
+            'cards': self.batcher.cards,
+        }
+
+
+def read_body(body, content_type):
+    """リクエスト本文（CSV または Arrow IPC ストリーム）を DataFrame にします。"""
+    if content_type.split(";")[0].strip() == ARROW_TYPE:
+        import pyarrow as pa
+        return pa.ipc.open_stream(body).read_all().to_pandas()
+    return ingest.read_race_card(io.BytesIO(body))
+
+
+def encode_result(result, fmt):
+    if fmt == 'arrow':
+        import pyarrow as pa
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, result.schema) as writer:
+            writer.write_table(result)
+        return sink.getvalue()
+    if fmt == 'csv':
+        return result.to_csv(index=False).encode('utf-8')
+    return result.to_json(orient='records', force_ascii=False).encode('utf-8')
+
+
+# ---------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send(self, status, body, content_type=CONTENT_TYPES['json']):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            return self._send_json(404, {'error': "not found"})
+        self._send_json(200, self.service.health())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            return self._send_json(404, {'error': "not found"})
+        fmt = parse_qs(url.query).get('format', ['json'])[0]
+        if fmt not in CONTENT_TYPES:
+            return self._send_json(400, {'error': f"未対応の出力形式です: {fmt}"})
+
+        with metrics.timer("server_request", format=fmt):
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                input_df = read_body(body, self.headers.get("Content-Type", "text/csv"))
+            except Exception as e:
+                return self._send_json(400, {'error': f"入力を読み込めません: {e}"})
+
+            result, error_msg = self.service.predict(input_df, output="arrow" if fmt == 'arrow' else "dataframe")
+            if error_msg:
+                return self._send_json(422, {'error': error_msg})
+            self._send(200, encode_result(result, fmt), CONTENT_TYPES[fmt])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(model_dir, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                max_wait_ms=DEFAULT_MAX_WAIT_MS, max_batch_rows=DEFAULT_MAX_BATCH_ROWS):
+    """予測サーバーを作ります（serve_forever() で起動）。モデルはここで読み込みます。"""
+    service = PredictionService(model_dir, MicroBatcher(max_wait_ms, max_batch_rows))
+    handler = type("Handler", (_Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="予測サーバー")
+    parser.add_argument("--model-dir", default="models/v1")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument("--max-batch-rows", type=int, default=DEFAULT_MAX_BATCH_ROWS)
+    args = parser.parse_args()
+
+    server = make_server(args.model_dir, args.host, args.port, args.max_wait_ms, args.max_batch_rows)
+    metrics.start_http_server()
+    print(f"serving {args.model_dir} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,75 @@
+# race_display.py
+"""
+メンバー画面に送る1レース分の表示用データ（payload）。
+
+予測の公開時に result_store がレースごとに作って保存しておき、画面側は読むだけにします。
+表示する列だけを残し、数値は小さい型（順位・枠・番は uint8、AI指数は float32）にそろえます。
+"""
+import pandas as pd
+
+# メンバー画面に表示する列（payload に保存する列）
+DISPLAY_COLUMNS = ['AI順位', '印', '枠', '番', '馬名', '騎手', 'AI指数']
+
+# 会員の role ごとに表示する列（DISPLAY_COLUMNS 以外の列は元の結果ファイルから読みます）
+ROLE_COLUMNS = {
+    'member': DISPLAY_COLUMNS,
+    'admin': DISPLAY_COLUMNS + ['枠評', '種牡馬'],
+}
+DEFAULT_ROLE = 'member'
+
+_DTYPES = {
+    'AI順位': 'uint8',
+    '枠': 'uint8',
+    '番': 'uint8',
+    'AI指数': 'float32',
+    '印': 'category',
+    '枠評': 'category',
+}
+
+# 1ページに表示するレース数の既定値（複数レース表示）
+DEFAULT_PAGE_SIZE = 4
+
+
+def columns_for(role):
+    """role に表示する列（未知の role はメンバーと同じ）。"""
+    return ROLE_COLUMNS.get(role, ROLE_COLUMNS[DEFAULT_ROLE])
+
+
+def make_payload(result_df, columns=None):
+    """
+    1レース分の予測結果から、AI順位順・表示列だけ・小さい型の DataFrame を作ります。
+    columns を省略すると DISPLAY_COLUMNS です。
+    """
+    columns = columns or DISPLAY_COLUMNS
+    df = result_df
+    if 'AI順位' in df.columns:
+        df = df.sort_values('AI順位', kind='stable')
+    df = df[[c for c in columns if c in df.columns]].reset_index(drop=True)
+
+    for col in ('印', '枠評'):
+        if col in df.columns:
+            df[col] = df[col].fillna('')
+    for col, dtype in _DTYPES.items():
+        if col not in df.columns:
+            continue
+        if dtype == 'uint8':
+            values = pd.to_numeric(df[col], errors='coerce')
+            # 欠損や範囲外があれば元の型のままにします
+            if values.notna().all() and values.between(0, 255).all():
+                df[col] = values.astype('uint8')
+        elif dtype == 'float32':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def paginate(items, page, page_size=DEFAULT_PAGE_SIZE):
+    """
+    items を page_size ずつに分けた page ページ目（1始まり）と、全ページ数を返します。
+    範囲外の page は最初・最後のページに丸めます。
+    """
+    page_size = max(int(page_size), 1)
+    n_pages = max((len(items) + page_size - 1) // page_size, 1)
+    page = min(max(int(page), 1), n_pages)
+    return items[(page - 1) * page_size: page * page_size], n_pages
@@ -0,0 +1,407 @@
+# result_store.py
+"""
+予測結果の保存先（data.csv の置き換え）。
+
+results/
+  CURRENT                 ... 公開中の run_id
+  <run_id>/manifest.json  ... レース一覧（日付, 場所, R）と、各レースのファイル内の位置
+  <run_id>/races.parquet  ... 予測結果（レースごとに1つの row group）
+  <run_id>/display.parquet ... メンバー画面用に整形済みのレース（race_display.make_payload、レースごとに1つの row group）
+
+予測1回ごとに run_id のフォルダを作り、結果はレース順に1つのファイルへ追記します。
+manifest に各レースの row group 番号を記録しておくので、画面側は1レース分だけを読めば済みます。
+結果に '日付' 列が無い場合（旧 data.csv など）は、日付を None として扱います。
+pyarrow が無い環境では parquet の代わりに pickle で保存します（位置は行番号の範囲、読み込みはファイル全体）。
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import metrics
+import race_display
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    DEFAULT_FORMAT = "parquet"
+except ImportError:
+    DEFAULT_FORMAT = "pickle"
+
+DEFAULT_ROOT = "results"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+RACES_FILE = "races"
+DISPLAY_FILE = "display"
+# 残しておく過去の予測の数
+KEEP_RUNS = 10
+
+_EXT = {"parquet": ".parquet", "pickle": ".pkl"}
+
+# 公開（CURRENT の差し替え）を直列化します
+_commit_lock = threading.Lock()
+
+
+# ---------------------------------------------------------
+# 1つのファイルにレースを追記する writer
+# ---------------------------------------------------------
+class _ParquetParts:
+    """
+    追記ごとに1つの row group を書きます。append() は row group 番号を返します。
+    base_path（引き継ぐ run の同じファイル）を渡すと、最初の追記の時点で両方の列を含むスキーマを作ります。
+    """
+
+    def __init__(self, path, base_path=None):
+        self.path = path
+        self.base_path = base_path
+        self._writer = None
+        self._schema = None
+        self._count = 0
+
+    def _make_schema(self, table):
+        # 全体が欠損の列は null 型になるので、後のレースと合うよう文字列にしておきます（日付は整数）
+        fields = [pa.field(f.name, pa.int64() if f.name == '日付' else pa.string()) if pa.types.is_null(f.type) else f
+                  for f in table.schema]
+        schema = pa.schema(fields, metadata=table.schema.metadata)
+        if self.base_path and os.path.exists(self.base_path):
+            try:
+                schema = pa.unify_schemas([schema, pq.read_schema(self.base_path)], promote_options="permissive")
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        return schema
+
+    def append(self, df):
+        table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+        if self._writer is None:
+            self._schema = self._make_schema(table)
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        # スキーマにあってこのレースに無い列は null で埋めます
+        for field in self._schema:
+            if field.name not in table.column_names:
+                table = table.append_column(field.name, pa.nulls(len(table), field.type))
+        table = table.select(self._schema.names).cast(self._schema)
+        self._writer.write_table(table, row_group_size=max(len(table), 1))
+        self._count += 1
+        return self._count - 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class _PickleParts:
+    """pyarrow が無い場合。close() で1つの pickle に書き、append() は行番号の範囲 [start, stop] を返します。"""
+
+    def __init__(self, path, base_path=None):
+        self.path = path
+        self._frames = []
+        self._rows = 0
+
+    def append(self, df):
+        self._frames.append(df.reset_index(drop=True))
+        start = self._rows
+        self._rows += len(df)
+        return [start, self._rows]
+
+    def close(self):
+        if self._frames:
+            pd.concat(self._frames, ignore_index=True).to_pickle(self.path)
+            self._frames = []
+
+
+def _open_parts(path, fmt, base_path=None):
+    return _ParquetParts(path, base_path) if fmt == "parquet" else _PickleParts(path)
+
+
+def _write_text_atomic(path, text):
+    tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _py(value):
+    """numpy の数値を JSON に書ける型に変換します。"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _race_key(date, place, race):
+    return (None if date is None else _py(date), _py(place), _py(race))
+
+
+def _iter_races(result_df):
+    """結果を (日付, 場所, R) ごとに分けて返します（'日付' 列が無ければ日付は None）。"""
+    if '日付' in result_df.columns:
+        for (date, place, race), df in result_df.groupby(['日付', '場所', 'R'], sort=False):
+            yield _race_key(date, place, race), df
+    else:
+        for (place, race), df in result_df.groupby(['場所', 'R'], sort=False):
+            yield _race_key(None, place, race), df
+
+
+def _with_date(df, date):
+    """'日付' 列を先頭にそろえます（日付の無い結果は欠損）。どの run も同じ列で保存するためです。"""
+    df = df.drop(columns='日付', errors='ignore')
+    df.insert(0, '日付', pd.array([date] * len(df), dtype='Int64'))
+    return df
+
+
+class RunWriter:
+    """
+    1回分の予測結果を書き込みます。write() を何度呼んでもよく、
+    commit() で公開（CURRENT の差し替え）されます。
+    merge=True なら、公開中の結果の列も含めたスキーマで書きます（commit() で引き継ぐため）。
+    """
+
+    def __init__(self, store, model_version=None, fmt=None, merge=False):
+        self.store = store
+        self.fmt = fmt or DEFAULT_FORMAT
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.run_dir = os.path.join(store.root, self.run_id)
+        os.makedirs(self.run_dir, exist_ok=True)
+        ext = _EXT[self.fmt]
+        self.manifest = {
+            'run_id': self.run_id,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'model_version': model_version,
+            'format': self.fmt,
+            'races_file': RACES_FILE + ext,
+            'display_file': DISPLAY_FILE + ext,
+            'rows': 0,
+            'races': [],
+        }
+        self._races = {}
+        self.merge = merge
+        base = store.manifest() if merge else None
+        base_dir = os.path.join(store.root, base['run_id']) if base else None
+        self._parts = _open_parts(os.path.join(self.run_dir, RACES_FILE + ext), self.fmt,
+                                  base and os.path.join(base_dir, base['races_file']))
+        self._display = _open_parts(os.path.join(self.run_dir, DISPLAY_FILE + ext), self.fmt,
+                                    base and os.path.join(base_dir, base['display_file']))
+
+    def write(self, result_df):
+        """結果のDataFrameを (日付, 場所, R) ごとに追記します。"""
+        with metrics.timer("predict_stage", stage="write"):
+            self._write(result_df)
+
+    def _entry(self, key, race_name):
+        entry = self._races.get(key)
+        if entry is None:
+            entry = {
+                'id': len(self._races),
+                '日付': key[0],
+                '場所': key[1],
+                'R': key[2],
+                'レース名': race_name,
+                'parts': [],
+                'display': None,
+                'rows': 0,
+            }
+            self._races[key] = entry
+            self.manifest['races'].append(entry)
+        return entry
+
+    def _write(self, result_df):
+        for key, df in _iter_races(result_df):
+            entry = self._entry(key, str(df['レース名'].iloc[0]) if 'レース名' in df.columns else "")
+            entry['parts'].append(self._parts.append(_with_date(df, key[0])))
+            entry['rows'] += len(df)
+            self.manifest['rows'] += len(df)
+            # 同じレースが分割されて届いた場合、payload は commit() で全体から作り直します
+            entry['display'] = self._display.append(race_display.make_payload(df)) if len(entry['parts']) == 1 else None
+
+    def commit(self, merge=None):
+        """
+        manifest を書いて、このrunを公開中にします。run_id を返します。
+        merge=True のときは、公開中の結果のうちこのrunに含まれないレースを引き継ぎます
+        （会場ごとに別々に予測して公開する場合など）。省略時は begin_run() の指定に従います。
+        """
+        merge = self.merge if merge is None else merge
+        with _commit_lock:
+            if merge:
+                self._carry_over(self.store.current_run())
+            self._parts.close()
+            for entry in self.manifest['races']:
+                if entry['display'] is None and entry['parts']:
+                    df = self.store._read_parts(self.run_dir, self.manifest, entry['parts'])
+                    entry['display'] = self._display.append(race_display.make_payload(df))
+            self._display.close()
+            _write_text_atomic(os.path.join(self.run_dir, MANIFEST_FILE),
+                               json.dumps(self.manifest, ensure_ascii=False, indent=1))
+            _write_text_atomic(os.path.join(self.store.root, CURRENT_FILE), self.run_id)
+        self.store.prune()
+        metrics.write_prometheus()
+        return self.run_id
+
+    def _carry_over(self, base_run_id):
+        if base_run_id is None or base_run_id == self.run_id:
+            return
+        base = self.store.manifest(base_run_id)
+        if base is None:
+            return
+        for r in base['races']:
+            key = _race_key(r.get('日付'), r['場所'], r['R'])
+            if key in self._races:
+                continue
+            df = self.store.read_race(r['場所'], r['R'], base_run_id, r.get('日付'))
+            if df is None:
+                continue
+            entry = self._entry(key, r.get('レース名', ""))
+            entry['parts'].append(self._parts.append(_with_date(df, key[0])))
+            entry['display'] = self._display.append(self.store.read_display(r['場所'], r['R'], base_run_id, r.get('日付')))
+            entry['rows'] += len(df)
+            self.manifest['rows'] += len(df)
+
+    def abort(self):
+        for parts in (self._parts, self._display):
+            try:
+                parts.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+class ResultStore:
+    """予測結果の保存・読み出し。"""
+
+    def __init__(self, root=DEFAULT_ROOT, keep_runs=KEEP_RUNS):
+        self.root = root
+        self.keep_runs = keep_runs
+        os.makedirs(root, exist_ok=True)
+        self._manifests = {}
+        # ファイルパス -> 開いた ParquetFile（pickle の場合は読み込んだDataFrame）
+        self._files = {}
+        self._files_lock = threading.Lock()
+
+    # --- 書き込み ---
+    def begin_run(self, model_version=None, fmt=None, merge=False):
+        return RunWriter(self, model_version, fmt, merge)
+
+    def publish(self, result_df, model_version=None, merge=False):
+        """結果をまとめて保存して公開します。run_id を返します。"""
+        writer = self.begin_run(model_version, merge=merge)
+        try:
+            writer.write(result_df)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def prune(self):
+        """古い予測結果を削除します（公開中のものは残します）。"""
+        current = self.current_run()
+        for run_id in self.runs()[:-self.keep_runs or None]:
+            if run_id != current:
+                run_dir = os.path.join(self.root, run_id)
+                with self._files_lock:
+                    for path in [p for p in self._files if os.path.dirname(p) == run_dir]:
+                        del self._files[path]
+                shutil.rmtree(run_dir, ignore_errors=True)
+                self._manifests.pop(run_id, None)
+
+    # --- 読み出し ---
+    def current_run(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def runs(self):
+        """manifest のある run_id を古い順に返します。"""
+        return sorted(d for d in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, d, MANIFEST_FILE)))
+
+    def manifest(self, run_id=None):
+        run_id = run_id or self.current_run()
+        if run_id is None:
+            return None
+        if run_id not in self._manifests:
+            with open(os.path.join(self.root, run_id, MANIFEST_FILE), encoding='utf-8') as f:
+                manifest = json.load(f)
+            manifest['index'] = {_race_key(r.get('日付'), r['場所'], r['R']): r for r in manifest['races']}
+            self._manifests[run_id] = manifest
+        return self._manifests[run_id]
+
+    def _entry(self, manifest, place, race, date=None):
+        """
+        (日付, 場所, R) の manifest のエントリ。
+        date を省略した場合は、その (場所, R) が1日分しか無いときだけ返します。
+        """
+        entry = manifest['index'].get(_race_key(date, place, race))
+        if entry is not None or date is not None:
+            return entry
+        found = [r for k, r in manifest['index'].items() if k[1:] == _race_key(None, place, race)[1:]]
+        return found[0] if len(found) == 1 else None
+
+    def _read_parts(self, run_dir, manifest, parts, fname=None):
+        """run のファイルから、指定した row group（pickle は行の範囲）を読み出します。"""
+        path = os.path.join(run_dir, fname or manifest['races_file'])
+        with self._files_lock:
+            handle = self._files.get(path)
+            if handle is None:
+                handle = pq.ParquetFile(path) if manifest['format'] == "parquet" else pd.read_pickle(path)
+                self._files[path] = handle
+            if manifest['format'] == "parquet":
+                frames = [handle.read_row_group(i).to_pandas() for i in parts]
+            else:
+                frames = [handle.iloc[start:stop].reset_index(drop=True) for start, stop in parts]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def dates(self, run_id=None):
+        """結果に含まれる日付（昇順、日付の無い結果は [None]）。"""
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return []
+        dates = {r.get('日付') for r in manifest['races']}
+        return sorted(dates, key=lambda d: (d is not None, d))
+
+    def locations(self, run_id=None, date=None):
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return []
+        return list(dict.fromkeys(r['場所'] for r in manifest['races'] if date is None or r.get('日付') == date))
+
+    def races(self, place, run_id=None, date=None):
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return []
+        return sorted(r['R'] for r in manifest['races']
+                      if r['場所'] == place and (date is None or r.get('日付') == date))
+
+    def read_race(self, place, race, run_id=None, date=None):
+        """1レース分の結果を返します（無ければ None）。"""
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return None
+        entry = self._entry(manifest, place, race, date)
+        if entry is None or not entry['parts']:
+            return None
+        df = self._read_parts(os.path.join(self.root, manifest['run_id']), manifest, entry['parts'])
+        if entry.get('日付') is None:
+            # 日付の無い結果は、保存時に付けた空の '日付' 列を外して返します
+            df = df.drop(columns='日付', errors='ignore')
+        return df
+
+    def read_display(self, place, race, run_id=None, date=None):
+        """1レース分のメンバー画面用 payload を返します（無ければ None）。"""
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return None
+        entry = self._entry(manifest, place, race, date)
+        if entry is None or entry.get('display') is None:
+            return None
+        return self._read_parts(os.path.join(self.root, manifest['run_id']), manifest, [entry['display']],
+                                manifest['display_file'])
+
+    def read_all(self, run_id=None):
+        """公開中（または指定）の予測結果をすべて読み込みます。"""
+        manifest = self.manifest(run_id)
+        if manifest is None:
+            return None
+        frames = [self.read_race(r['場所'], r['R'], manifest['run_id'], r.get('日付')) for r in manifest['races']]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
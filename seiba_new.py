@@ -1,25 +1,48 @@
 # seiba_new.py
 import streamlit as st
-import pandas as pd
 import os
 import shutil
-from supabase import create_client, Client
-import logic # ★先ほど作った logic.py を読み込みます
+import model_bundle
+import result_store
+import dashboard_data
+import multi_model
+import jobs
+import metrics
+import ingest
+import race_display
+import members
+import model_registry
 
 # ---------------------------------------------------------
 # 0. System Functions
 # ---------------------------------------------------------
 def init_connection():
+    # 会員DB（Supabase）へのアクセス。HTTP接続と会員一覧のキャッシュはプロセス内で共有されます
     try:
-        url = os.environ.get("SUPABASE_URL")
-        key = os.environ.get("SUPABASE_KEY")
-        if not url or not key:
-            return None
-        return create_client(url, key)
+        return members.get_repository()
     except:
         return None
 
-supabase = init_connection()
+member_repo = init_connection()
+
+@st.cache_resource
+def warm_up_models():
+    # 起動時に一度だけモデルを読み込んでおきます
+    # SEIBA_WARM_MODELS=v1,v2 のように指定がなければ models/ 内の使えるバージョンを対象にします
+    models_dir = "models"
+    names = [n.strip() for n in os.environ.get("SEIBA_WARM_MODELS", "").split(",") if n.strip()]
+    if not names:
+        names = model_registry.get_registry(models_dir).good_versions()[-model_bundle.MAX_CACHED_BUNDLES:]
+    return model_bundle.warm_up([os.path.join(models_dir, n) for n in names])
+
+warm_up_models()
+
+@st.cache_resource
+def start_metrics_server():
+    # SEIBA_METRICS_PORT が指定されていれば /metrics を公開します
+    return metrics.start_http_server()
+
+start_metrics_server()
 
 def safe_rerun():
     try:
@@ -31,17 +54,54 @@ def safe_rerun():
             st.error("Please refresh.")
 
 def load_data(file_path):
-    df = None
-    encodings = ['utf-8', 'cp932', 'shift_jis']
-    for enc in encodings:
-        try:
-            df = pd.read_csv(file_path, encoding=enc)
-            break
-        except UnicodeDecodeError:
-            continue
-        except FileNotFoundError:
-            return None
-    return df
+    # 文字コードは先頭部分から1回で判定します
+    return ingest.read_results(file_path)
+
+store = result_store.ResultStore()
+
+def migrate_legacy_data():
+    # 旧形式の data.csv しか無い場合は、一度だけ結果ストアに取り込みます
+    if store.current_run() is None and os.path.exists('data.csv'):
+        df = load_data('data.csv')
+        if df is not None and not df.empty:
+            store.publish(df, model_version='data.csv')
+
+migrate_legacy_data()
+
+@st.cache_resource
+def get_job_queue():
+    # 予測ジョブのワーカーはプロセスで1つだけ起動します
+    return jobs.JobQueue(store)
+
+job_queue = get_job_queue()
+
+def jobs_table():
+    # ジョブの状態一覧
+    jobs_df = job_queue.list_jobs()
+    if jobs_df.empty:
+        st.caption("No jobs yet.")
+        return
+    # レース総数はCSVを読み終わるまで分からないので、それまでは処理済みの数だけを表示します
+    done = jobs_df['races_done'].fillna(0).astype(int).astype(str)
+    total = jobs_df['races_total'].astype('Int64').astype(str)
+    jobs_df['progress'] = done.where(jobs_df['races_total'].isna(), done + " / " + total)
+    st.dataframe(jobs_df[['id', 'label', 'status', 'model_version', 'progress', 'rows', 'elapsed', 'note', 'error']],
+                 use_container_width=True, hide_index=True)
+
+def live_jobs_table():
+    # 実行中のジョブがある間だけ定期的に再描画し、すべて終わったら画面全体を更新して結果を反映します
+    jobs_table()
+    if not job_queue.has_active():
+        safe_rerun()
+
+if hasattr(st, "fragment"):
+    live_jobs_table = st.fragment(run_every=3)(live_jobs_table)
+
+def show_jobs():
+    if hasattr(st, "fragment") and job_queue.has_active():
+        live_jobs_table()
+    else:
+        jobs_table()
 
 # ---------------------------------------------------------
 # 1. Page Configuration
@@ -132,7 +192,7 @@ with col_main:
 
     # --- AUTHENTICATION ---
     if not st.session_state.user:
-        if not supabase:
+        if not member_repo:
             st.warning("Maintenance Mode: Database connecting...")
             st.stop()
             
@@ -151,9 +211,8 @@ with col_main:
                     if btn:
                         if username and password:
                             try:
-                                res = supabase.table('users').select("*").eq('username', username).eq('password', password).execute()
-                                if len(res.data) > 0:
-                                    user_data = res.data[0]
+                                user_data = member_repo.authenticate(username, password)
+                                if user_data:
                                     if user_data['status'] == 'approved':
                                         st.session_state.user = user_data
                                         safe_rerun()
@@ -181,17 +240,10 @@ with col_main:
                     if reg_btn:
                         if new_user and new_pass:
                             try:
-                                check = supabase.table('users').select("*").eq('username', new_user).execute()
-                                if len(check.data) > 0:
-                                    st.error("Username already taken.")
-                                else:
-                                    supabase.table('users').insert({
-                                        "username": new_user,
-                                        "password": new_pass,
-                                        "status": "pending",
-                                        "role": "member"
-                                    }).execute()
+                                if member_repo.register(new_user, new_pass):
                                     st.success("Application Sent.")
+                                else:
+                                    st.error("Username already taken.")
                             except Exception as e:
                                 st.error(f"Register Error: {e}")
                         else:
@@ -215,12 +267,15 @@ with col_main:
             with adm_tab1:
                 st.write("##### 1. Select AI Model")
                 
-                # modelsフォルダ内のサブフォルダを列挙
+                # modelsフォルダ内の使えるバージョンだけを表示（検証結果はフォルダが変わるまで使い回し）
                 models_dir = "models"
                 if not os.path.exists(models_dir):
                     os.makedirs(models_dir) # なければ作る
-                    
-                model_options = [d for d in os.listdir(models_dir) if os.path.isdir(os.path.join(models_dir, d))]
+
+                registry = model_registry.get_registry(models_dir)
+                model_options, broken = registry.split()
+                for ver, problems in broken.items():
+                    st.warning(f"⚠️ {ver} は使用できません: " + " / ".join(problems))
                 
                 if not model_options:
                     st.error(f"❌ '{models_dir}' フォルダ内にモデルフォルダが見つかりません。")
@@ -230,29 +285,44 @@ with col_main:
                     st.write("##### 2. Upload Race Data (CSV)")
                     uploaded_file = st.file_uploader("予測用CSVファイル（jra1217.csv等）", type="csv")
                     
+                    # 予測はバックグラウンドのジョブとして実行します（ボタンを押すとすぐに戻ります）
+                    merge_mode = st.checkbox("公開中の結果に追加する（会場ごとに別々にアップロードする場合）", value=False)
+                    incremental_mode = st.checkbox("変更のあったレースだけ再計算する（取消・乗り替わり等の再アップロード）", value=False)
+                    max_races = st.number_input("1回に処理する最大レース数", min_value=1, value=jobs.DEFAULT_MAX_RACES)
+
                     if uploaded_file is not None:
                         if st.button("🚀 Run Prediction & Update System"):
-                            with st.spinner("AI Brain is thinking..."):
+                            try:
+                                model_path = os.path.join(models_dir, selected_model_ver)
+                                job_id = job_queue.submit(uploaded_file.getvalue(), model_path, label=uploaded_file.name,
+                                                          max_races=int(max_races), merge=merge_mode,
+                                                          incremental=incremental_mode)
+                                st.success(f"✅ ジョブ #{job_id} を登録しました。完了すると結果が自動で更新されます。 (Model: {selected_model_ver})")
+                            except Exception as e:
+                                st.error(f"Processing Error: {e}")
+
+                    st.write("##### Jobs")
+                    show_jobs()
+
+                    # 複数モデルで同じCSVを同時に予測して比較（結果は公開しません）
+                    st.write("##### 3. Compare Models")
+                    compare_vers = st.multiselect("比較するモデルバージョン", model_options, default=[selected_model_ver])
+
+                    if uploaded_file is not None and len(compare_vers) >= 2:
+                        if st.button("⚖️ Compare Models"):
+                            with st.spinner("Comparing models..."):
                                 try:
-                                    # アップロードされたファイルを一時的にDataFrameとして読む
-                                    # header=Noneで読む（前回の形式に合わせて）
-                                    try:
-                                        input_df = pd.read_csv(uploaded_file, header=None, encoding='cp932')
-                                    except:
-                                        uploaded_file.seek(0)
-                                        input_df = pd.read_csv(uploaded_file, header=None, encoding='utf-8')
-
-                                    # ロジックファイルに投げて計算させる
-                                    model_path = os.path.join(models_dir, selected_model_ver)
-                                    result_df, error_msg = logic.execute_prediction(input_df, model_path)
-                                    
-                                    if error_msg:
-                                        st.error(f"Error: {error_msg}")
-                                    else:
-                                        # 結果を保存
-                                        result_df.to_csv("data.csv", index=False, encoding='utf-8')
-                                        st.success(f"✅ 予測完了！ 結果を更新しました。 (Model: {selected_model_ver})")
-                                        st.dataframe(result_df.head(3)) # チラ見せ
+                                    uploaded_file.seek(0)
+                                    input_df = ingest.read_race_card(uploaded_file)
+
+                                    model_paths = [os.path.join(models_dir, v) for v in compare_vers]
+                                    compare_df, errors = multi_model.compare_versions(input_df, model_paths, base_version=selected_model_ver)
+
+                                    for ver, msg in errors.items():
+                                        st.error(f"{ver}: {msg}")
+                                    if compare_df is not None:
+                                        st.caption(f"基準モデル: {selected_model_ver}（順位差がマイナスなら基準より上位）")
+                                        st.dataframe(compare_df, use_container_width=True, hide_index=True)
 
                                 except Exception as e:
                                     st.error(f"Processing Error: {e}")
@@ -261,17 +331,29 @@ with col_main:
             with adm_tab2:
                 st.write("##### ⚠️ Pending Requests")
                 try:
-                    pending_users = supabase.table('users').select("*").eq('status', 'pending').execute().data
+                    # 一覧はキャッシュされ、承認・削除のときだけ取り直します
+                    pending_users = member_repo.list_pending()
                     if pending_users:
                         for p_user in pending_users:
                             c1, c2, c3 = st.columns([2, 1, 1])
                             c1.info(f"User: {p_user['username']}")
                             if c2.button("APPROVE", key=f"app_{p_user['id']}"):
-                                supabase.table('users').update({"status": "approved"}).eq("id", p_user['id']).execute()
+                                member_repo.approve([p_user['id']])
                                 safe_rerun()
                             if c3.button("REJECT", key=f"rej_{p_user['id']}"):
-                                supabase.table('users').delete().eq("id", p_user['id']).execute()
+                                member_repo.reject([p_user['id']])
                                 safe_rerun()
+
+                        # まとめて承認・却下（1回のリクエスト）
+                        names = {u['id']: u['username'] for u in pending_users}
+                        selected_ids = st.multiselect("まとめて処理", list(names), format_func=lambda i: names[i])
+                        b1, b2 = st.columns(2)
+                        if b1.button("APPROVE SELECTED", disabled=not selected_ids):
+                            member_repo.approve(selected_ids)
+                            safe_rerun()
+                        if b2.button("REJECT SELECTED", disabled=not selected_ids):
+                            member_repo.reject(selected_ids)
+                            safe_rerun()
                     else:
                         st.caption("No pending requests.")
                 except:
@@ -281,7 +363,7 @@ with col_main:
                 
                 st.write("##### 👥 Active Members")
                 try:
-                    active_users = supabase.table('users').select("*").eq('status', 'approved').neq('role', 'admin').execute().data
+                    active_users = member_repo.list_active()
                     if active_users:
                         for a_user in active_users:
                             col_u, col_p, col_btn = st.columns([2, 2, 1])
@@ -291,7 +373,7 @@ with col_main:
                                 st.caption(f"Pass: {a_user['password']}")
                             with col_btn:
                                 if st.button("REMOVE", key=f"del_{a_user['id']}"):
-                                    supabase.table('users').delete().eq("id", a_user['id']).execute()
+                                    member_repo.remove([a_user['id']])
                                     st.warning(f"Removed {a_user['username']}")
                                     safe_rerun()
                             st.divider()
@@ -306,51 +388,67 @@ with col_main:
             # =========================================================
 
         # --- DATA DISPLAY (一般ユーザー・管理者共通) ---
-        df = None
-        if os.path.exists('data.csv'):
-            df = load_data('data.csv')
-        
-        if df is not None:
+        # 公開中の予測ごとにキャッシュされたデータ（新しい予測が公開されると自動で切り替わる）
+        data = dashboard_data.get_dashboard_data(store)
+
+        if data is not None:
             try:
                 # --- START FILTER BOX ---
                 st.markdown("<div class='glass-box'>", unsafe_allow_html=True)
-                f_col1, f_col2 = st.columns(2)
+                # 複数日分の結果が公開されている場合は日付を選びます（既定は最新の日付）
+                dates = data.dates
+                selected_date = data.latest_date
+                if len(dates) > 1:
+                    selected_date = st.selectbox("DATE", dates, index=len(dates) - 1,
+                                                 format_func=lambda d: f"{int(d):06d}" if d is not None else "-")
+                f_col1, f_col2, f_col3 = st.columns([2, 2, 1])
                 
-                locations = df['場所'].unique()
+                locations = data.locations(selected_date)
                 selected_location = f_col1.selectbox("LOCATION", locations)
-                df_loc = df[df['場所'] == selected_location]
-                races = sorted(df_loc['R'].unique())
-                selected_race = f_col2.selectbox("RACE", races, format_func=lambda x: f"{x}R")
+                races = data.races(selected_location, selected_date)
+                # 1レースずつ表示するか、会場の全レースをページごとに表示するか
+                view_mode = f_col3.radio("VIEW", ["1 RACE", "ALL RACES"], horizontal=True)
+                if view_mode == "1 RACE":
+                    selected_race = f_col2.selectbox("RACE", races, format_func=lambda x: f"{x}R")
+                else:
+                    page_size = race_display.DEFAULT_PAGE_SIZE
+                    n_pages = max((len(races) + page_size - 1) // page_size, 1)
+                    page = f_col2.number_input("PAGE", min_value=1, max_value=n_pages, value=1)
                 st.markdown("</div>", unsafe_allow_html=True)
                 # --- END FILTER BOX ---
 
-                df_display = df_loc[df_loc['R'] == selected_race].copy()
-                
-                # --- DATA CHECK ---
-                if df_display.empty:
-                    st.info(f"{selected_location} {selected_race}R のデータは現在用意されていません。")
+                # 表示する列は会員の role で変わります（race_display.ROLE_COLUMNS）
+                role = user.get('role', race_display.DEFAULT_ROLE)
+                if view_mode == "1 RACE":
+                    race_views = [(selected_race, data.race_name(selected_location, selected_race, selected_date),
+                                   data.race_frame(selected_location, selected_race, role, selected_date))]
                 else:
-                    # --- DISPLAY LOGIC ---
-                    race_name = df_display['レース名'].iloc[0] if 'レース名' in df_display.columns else ""
-                    
+                    race_views, _ = data.race_page(selected_location, page, role=role, date=selected_date)
+
+                for race_no, race_name, df_display in race_views:
+                    # --- DATA CHECK ---
+                    if df_display is None or df_display.empty:
+                        st.info(f"{selected_location} {race_no}R のデータは現在用意されていません。")
+                        continue
+
                     # レースタイトル（仕切り線なし）
                     st.markdown(f"""
                         <div class="race-title-separator" style="text-align: center; margin: 30px 0; padding: 15px;">
-                            <span style="font-family: 'Playfair Display'; font-weight: 500; font-size: 1.5rem; color: #fff;">{selected_location} {selected_race}R</span><br>
+                            <span style="font-family: 'Playfair Display'; font-weight: 500; font-size: 1.5rem; color: #fff;">{selected_location} {race_no}R</span><br>
                             <span style="font-family: 'Lato'; color: #888; letter-spacing: 0.1em;">{race_name}</span>
                         </div>
                     """, unsafe_allow_html=True)
                     
-                    # ★ここでユーザーランクに応じた表示項目の変更ができます（将来的な拡張ポイント）
-                    cols = ['AI順位', '印', '枠', '番', '馬名', '騎手', 'AI指数']
-                    show_cols = [c for c in cols if c in df_display.columns]
-                    
-                    if '印' in df_display.columns: df_display['印'] = df_display['印'].fillna('')
-                    if 'AI順位' in df_display.columns: df_display = df_display.sort_values('AI順位')
-                    
                     st.markdown("<div class='glass-box'>", unsafe_allow_html=True)
-                    st.dataframe(df_display[show_cols], use_container_width=True, hide_index=True)
+                    st.dataframe(df_display, use_container_width=True, hide_index=True)
                     st.markdown("</div>", unsafe_allow_html=True)
+
+                # コース別の枠評（モデルの統計から表示、予測の再実行は不要）
+                course_ids = data.courses()
+                if course_ids:
+                    with st.expander("COURSE / FRAME"):
+                        selected_course = st.selectbox("COURSE", course_ids)
+                        st.dataframe(data.course_frame_table(selected_course), use_container_width=True, hide_index=True)
             
             except Exception as e:
                 st.error(f"System Error: {e}")
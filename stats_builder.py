@@ -0,0 +1,249 @@
+# stats_builder.py
+"""
+過去の結果CSV（jra1217.csv 形式、着順入り）から models/<ver>/ の統計（jra_*_stats_3y.pkl）を作ります。
+
+    # 3年分の結果を取り込んで models/v2 を作る
+    python stats_builder.py history/*.csv --version v2 --model-from models/v1
+    # 翌週: 新しい週の結果だけを取り込み、直近3年で作り直す
+    python stats_builder.py week_251221.csv --version v3 --model-from models/v2
+
+結果CSVはチャンクごとに読み、日付ごとの (件数, 3着以内の数) だけを stats_data/partials/<日付>.pkl に保存します。
+統計は期間内の日付の集計を足し合わせて作るので、週ごとの更新では新しい週のCSVだけを読めば済み、
+期間（既定 3年）より古い日付は自動的に外れます。同じ日付を取り込み直すと、その日付の集計は置き換わります。
+
+統計の値は「3着以内率」（Series 名は 'target'）、コース枠はあわせて出走数（counts）を書き出します。
+モデル本体（jra_3y_model.pkl）は学習しないため、--model-from のフォルダからコピーします。
+"""
+import argparse
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import ingest
+import logic
+import model_registry
+import stats_index
+from model_bundle import MODEL_FILE, STATS_FILES
+
+DEFAULT_DATA_DIR = os.path.join("stats_data", "partials")
+DEFAULT_MODELS_DIR = "models"
+DEFAULT_CHUNKSIZE = 200000
+# 統計に使う期間（日）
+DEFAULT_WINDOW_DAYS = 3 * 365
+
+# 元CSVの列番号
+DATE_COL = 0
+FINISH_COL = 23
+TRACK_COL, DISTANCE_COL, WAKU_COL = 5, 6, 22
+# この着順以内を的中(target=1)とします
+TARGET_TOP = 3
+
+# 名前で集計する統計: キー -> 元CSVの列番号（Series の index 名は logic.RENAME_MAP の列名）
+ENTITY_COLUMNS = {
+    'sire_stats': 16,
+    'bms_stats': 20,
+    'jockey_stats': 10,
+    'trainer_stats': 12,
+    'breeder_stats': 15,
+}
+CF_TABLE = 'course_frame'
+
+
+def parse_date(value):
+    """列0の日付（YYMMDD、例: 251214）を datetime にします。"""
+    return datetime.strptime(f"{int(value):06d}", "%y%m%d")
+
+
+# ---------------------------------------------------------
+# 日付ごとの集計（取り込み）
+# ---------------------------------------------------------
+def aggregate_chunk(chunk, finish_col=FINISH_COL):
+    """
+    結果CSVの1チャンクを (日付, 表, キー, 枠番) ごとの 件数(n)・3着以内の数(hits) に集計します。
+    着順が 0 以下・空欄の行（未確定・取消）は除きます。
+    """
+    finish = pd.to_numeric(chunk[finish_col], errors='coerce')
+    chunk = chunk[finish > 0]
+    if chunk.empty:
+        return pd.DataFrame(columns=['日付', 'table', 'key', '枠番', 'n', 'hits'])
+    hit = (finish[finish > 0] <= TARGET_TOP).astype(np.int64).to_numpy()
+    dates = pd.to_numeric(chunk[DATE_COL], errors='coerce').to_numpy()
+
+    parts = []
+    for table, col in ENTITY_COLUMNS.items():
+        parts.append(pd.DataFrame({
+            '日付': dates, 'table': table, 'key': chunk[col].astype(str).str.strip().to_numpy(),
+            '枠番': -1, 'hit': hit,
+        }))
+    parts.append(pd.DataFrame({
+        '日付': dates, 'table': CF_TABLE,
+        'key': logic.make_course_id(chunk[TRACK_COL].to_numpy(), chunk[DISTANCE_COL].to_numpy()),
+        '枠番': pd.to_numeric(chunk[WAKU_COL], errors='coerce').fillna(0).astype(np.int64).to_numpy(),
+        'hit': hit,
+    }))
+    rows = pd.concat(parts, ignore_index=True)
+    g = rows.groupby(['日付', 'table', 'key', '枠番'], sort=False)['hit']
+    return pd.DataFrame({'n': g.size(), 'hits': g.sum()}).reset_index()
+
+
+def _merge_partials(frames):
+    df = pd.concat(frames, ignore_index=True)
+    return df.groupby(['table', 'key', '枠番'], sort=True, as_index=False)[['n', 'hits']].sum()
+
+
+class PartialStore:
+    """日付 -> その日の集計 を1ファイルずつ保存します。"""
+
+    def __init__(self, data_dir=DEFAULT_DATA_DIR):
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _path(self, date):
+        return os.path.join(self.data_dir, f"{int(date):06d}.pkl")
+
+    def dates(self):
+        return sorted(int(f[:-4]) for f in os.listdir(self.data_dir) if f.endswith(".pkl") and f[:-4].isdigit())
+
+    def get(self, date):
+        return pd.read_pickle(self._path(date))
+
+    def put(self, date, df):
+        path = self._path(date)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+
+def ingest_results(sources, store=None, finish_col=FINISH_COL, chunksize=DEFAULT_CHUNKSIZE, encoding=None):
+    """
+    結果CSVをチャンクごとに読み、日付ごとの集計を保存します。
+    チャンクに出てこなくなった日付から順に書き出すので、メモリに持つのは数日分の集計だけです。
+    戻り値: 取り込んだ日付の一覧
+    """
+    store = store or PartialStore()
+    written = set()
+    pending = {}
+
+    def flush(date):
+        frames = pending.pop(date)
+        if date in written:
+            # 日付順に並んでいないファイルで、書き出し済みの日付がもう一度出てきた場合
+            frames.append(store.get(date))
+        store.put(date, _merge_partials(frames))
+        written.add(date)
+
+    for source in sources:
+        for chunk in ingest.iter_race_card(source, chunksize, encoding=encoding):
+            agg = aggregate_chunk(chunk, finish_col)
+            seen = set()
+            for date, part in agg.groupby('日付', sort=False):
+                date = int(date)
+                pending.setdefault(date, []).append(part.drop(columns='日付'))
+                seen.add(date)
+            for date in [d for d in pending if d not in seen]:
+                flush(date)
+        for date in list(pending):
+            flush(date)
+    return sorted(written)
+
+
+# ---------------------------------------------------------
+# 統計の作成（期間内の集計の合計）
+# ---------------------------------------------------------
+def window_dates(dates, end=None, window_days=DEFAULT_WINDOW_DAYS):
+    """end（YYMMDD、省略時は最新の日付）までの window_days 日間に入る日付。"""
+    if not dates:
+        return []
+    end = int(end) if end is not None else max(dates)
+    start = parse_date(end) - timedelta(days=window_days)
+    return [d for d in dates if start < parse_date(d) <= parse_date(end)]
+
+
+def build_tables(store, dates):
+    """指定した日付の集計を合計し、{STATS_FILES のキー: Series} を返します。"""
+    if not dates:
+        raise ValueError("統計を作る対象の日付がありません。")
+    totals = _merge_partials([store.get(d) for d in dates])
+
+    tables = {}
+    for table, col in ENTITY_COLUMNS.items():
+        part = totals[totals['table'] == table]
+        index = pd.Index(part['key'].to_numpy(), name=logic.RENAME_MAP[col])
+        tables[table] = pd.Series((part['hits'] / part['n']).to_numpy(), index=index, name='target')
+
+    part = totals[totals['table'] == CF_TABLE]
+    index = pd.MultiIndex.from_arrays([part['key'].to_numpy(), part['枠番'].to_numpy(dtype=np.int64)],
+                                      names=['コースID', '枠番'])
+    tables['cf_stats'] = pd.Series((part['hits'] / part['n']).to_numpy(), index=index, name='target')
+    tables['cf_counts'] = pd.Series(part['n'].to_numpy(dtype=np.int64), index=index, name='target')
+    return tables
+
+
+def write_version(tables, version, models_dir=DEFAULT_MODELS_DIR, model_from=None, overwrite=False, info=None):
+    """
+    models/<version>/ に統計（と --model-from のモデル本体）を書き出し、検索用 index/ も作ります。
+    モデル本体がそろっていれば manifest.json（info の内容も含む）も書き出します。
+    一時フォルダに書いてから名前を変えるので、途中の状態のフォルダが画面に出ることはありません。
+    """
+    model_dir = os.path.join(models_dir, version)
+    if os.path.exists(model_dir) and not overwrite:
+        raise FileExistsError(f"{model_dir} は既にあります（上書きは overwrite=True）")
+
+    tmp_dir = os.path.join(models_dir, f".{version}.tmp.{os.getpid()}")
+    os.makedirs(tmp_dir)
+    try:
+        for key, fname in STATS_FILES.items():
+            joblib.dump(tables[key], os.path.join(tmp_dir, fname))
+        if model_from:
+            src = os.path.join(model_from, MODEL_FILE)
+            if os.path.exists(src):
+                shutil.copyfile(src, os.path.join(tmp_dir, MODEL_FILE))
+        stats_index.build_index(tmp_dir)
+        if os.path.exists(os.path.join(tmp_dir, MODEL_FILE)):
+            model_registry.write_manifest(tmp_dir, extra=info)
+
+        if os.path.exists(model_dir):
+            shutil.rmtree(model_dir)
+        os.replace(tmp_dir, model_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return model_dir
+
+
+def build_version(version, store=None, end=None, window_days=DEFAULT_WINDOW_DAYS,
+                  models_dir=DEFAULT_MODELS_DIR, model_from=None, overwrite=False):
+    """保存済みの集計から、期間内の統計を作って models/<version>/ に書き出します。"""
+    store = store or PartialStore()
+    dates = window_dates(store.dates(), end, window_days)
+    tables = build_tables(store, dates)
+    info = {'stats_window': {'start': dates[0], 'end': dates[-1], 'dates': len(dates), 'window_days': window_days},
+            'model_from': model_from}
+    return write_version(tables, version, models_dir, model_from, overwrite, info), dates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="結果CSVから統計（models/<ver>/）を作ります")
+    parser.add_argument("sources", nargs="*", help="取り込む結果CSV（省略時は保存済みの集計だけで作成）")
+    parser.add_argument("--version", help="作成する models/ 内のフォルダ名（省略時は取り込みのみ）")
+    parser.add_argument("--model-from", help="モデル本体をコピーするフォルダ（例: models/v1）")
+    parser.add_argument("--end", type=int, help="期間の最終日（YYMMDD、省略時は最新の日付）")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS)
+    parser.add_argument("--finish-col", type=int, default=FINISH_COL)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--models-dir", default=DEFAULT_MODELS_DIR)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    store = PartialStore(args.data_dir)
+    if args.sources:
+        dates = ingest_results(args.sources, store, finish_col=args.finish_col)
+        print(f"取り込み: {len(dates)} 日分")
+    if args.version:
+        model_dir, dates = build_version(args.version, store, args.end, args.window_days,
+                                         args.models_dir, args.model_from, args.overwrite)
+        print(f"{model_dir}: {dates[0]} - {dates[-1]}（{len(dates)} 日分）")
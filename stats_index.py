@@ -0,0 +1,222 @@
+# stats_index.py
+"""
+騎手・種牡馬などの統計（jra_*_stats_3y.pkl）を、
+ソート済みの名前一覧(vocab) + float32 のスコア配列に変換して保存します。
+
+    python stats_index.py models/v1
+
+models/<ver>/index/ に <名前>.vocab.npy / <名前>.scores.npy が作られ、
+np.load(mmap_mode='r') で読み込むため、複数プロセスでページキャッシュを共有できます。
+
+コース枠の統計は、出走数の下限と既定値を適用済みの (コース × 枠番) の行列として
+course_frame.courses.npy / course_frame.matrix.npy に保存します。
+"""
+import argparse
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+INDEX_DIR = "index"
+META_FILE = "meta.json"
+
+# 名前で引く統計
+ENTITY_STATS = {
+    'sire_stats': "jra_sire_stats_3y.pkl",
+    'bms_stats': "jra_bms_stats_3y.pkl",
+    'jockey_stats': "jra_jockey_stats_3y.pkl",
+    'trainer_stats': "jra_trainer_stats_3y.pkl",
+    'breeder_stats': "jra_breeder_stats_3y.pkl",
+}
+
+# コース枠の統計（行列に変換）
+CF_STATS_FILE = "jra_course_frame_stats_3y.pkl"
+CF_COUNTS_FILE = "jra_course_frame_counts_3y.pkl"
+CF_KEY = "course_frame"
+
+# 統計に存在しない名前・コース枠のスコア
+DEFAULT_SCORE = 0.2
+# コース枠スコアを採用する最低出走数
+CF_MIN_COUNT = 5
+# 行列に持つ枠番の最大値（列は 0..MAX_WAKU、範囲外の枠番は既定値）
+MAX_WAKU = 8
+
+
+def _encode(vocab, names):
+    """
+    名前の列をまとめて、ソート済み vocab 内の位置に変換します（存在しない名前は -1）。
+    重複する名前は1回だけ検索します。
+    """
+    codes, uniques = pd.factorize(pd.Series(names, dtype=object), use_na_sentinel=True)
+    if len(vocab) == 0 or len(uniques) == 0:
+        return np.full(len(codes), -1, dtype=np.int64)
+    keys = np.array([u if isinstance(u, str) else "" for u in uniques], dtype=str)
+    is_str = np.array([isinstance(u, str) for u in uniques])
+    pos = np.searchsorted(vocab, keys)
+    pos = np.minimum(pos, len(vocab) - 1)
+    found = is_str & (vocab[pos] == keys)
+    unique_ids = np.where(found, pos, -1)
+    return np.where(codes >= 0, unique_ids[codes], -1)
+
+
+class EntityIndex:
+    """ソート済みの名前一覧とスコア配列による一括検索。"""
+
+    def __init__(self, vocab, scores):
+        self.vocab = vocab
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.vocab)
+
+    @classmethod
+    def from_stats(cls, stats):
+        """pickle の中身（Series または dict）から作ります。"""
+        if not isinstance(stats, pd.Series):
+            stats = pd.Series(stats, dtype=float)
+        stats = stats[[isinstance(k, str) for k in stats.index]]
+        stats = stats[~stats.index.duplicated(keep='first')].sort_index()
+        vocab = np.array(stats.index, dtype=str)
+        scores = stats.to_numpy(dtype=np.float32)
+        return cls(vocab, scores)
+
+    @classmethod
+    def load(cls, index_dir, key, mmap=True):
+        mode = 'r' if mmap else None
+        vocab = np.load(os.path.join(index_dir, f"{key}.vocab.npy"), mmap_mode=mode)
+        scores = np.load(os.path.join(index_dir, f"{key}.scores.npy"), mmap_mode=mode)
+        return cls(vocab, scores)
+
+    def save(self, index_dir, key):
+        np.save(os.path.join(index_dir, f"{key}.vocab.npy"), self.vocab)
+        np.save(os.path.join(index_dir, f"{key}.scores.npy"), self.scores)
+
+    def encode(self, names):
+        """名前の列をまとめて整数IDに変換します（存在しない名前は -1）。"""
+        return _encode(self.vocab, names)
+
+    def lookup(self, names, default=DEFAULT_SCORE):
+        """名前の列をまとめてスコアに変換します（存在しない名前は default）。"""
+        ids = self.encode(names)
+        # mmap した配列全体をコピーしないよう、必要な要素だけを取り出してから型を変えます
+        values = self.scores[np.maximum(ids, 0)].astype(float)
+        return np.where(ids >= 0, values, default)
+
+    def get(self, name, default=DEFAULT_SCORE):
+        return self.lookup([name], default)[0]
+
+
+class CourseFrameMatrix:
+    """
+    コースID -> 行番号 の一覧と、(コース × 枠番) のスコア行列。
+    出走数が CF_MIN_COUNT 未満・統計にない組み合わせは、作成時に default を入れてあります。
+    """
+
+    def __init__(self, courses, matrix):
+        self.courses = courses
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.courses)
+
+    @classmethod
+    def from_stats(cls, cf_stats, cf_counts, min_count=CF_MIN_COUNT, default=DEFAULT_SCORE):
+        """(コースID, 枠番) の MultiIndex を持つ統計と出走数の Series から作ります。"""
+        cf_stats = cf_stats[~cf_stats.index.duplicated(keep='first')]
+        cf_counts = cf_counts[~cf_counts.index.duplicated(keep='first')]
+        course_ids = cf_stats.index.get_level_values(0)
+        waku = pd.to_numeric(cf_stats.index.get_level_values(1), errors='coerce')
+        valid = np.array([isinstance(c, str) for c in course_ids]) & (waku >= 0) & (waku <= MAX_WAKU)
+
+        c_pos = cf_counts.index.get_indexer(cf_stats.index)
+        counts = cf_counts.to_numpy(dtype=float)[c_pos]
+        ok = valid & (c_pos >= 0) & ~(counts < min_count)
+
+        courses = np.unique(np.array(course_ids[valid], dtype=str))
+        matrix = np.full((len(courses), MAX_WAKU + 1), default, dtype=float)
+        rows = np.searchsorted(courses, np.array(course_ids[ok], dtype=str))
+        matrix[rows, waku[ok].astype(int)] = cf_stats.to_numpy(dtype=float)[ok]
+        return cls(courses, matrix)
+
+    @classmethod
+    def load(cls, index_dir, key=CF_KEY, mmap=True):
+        mode = 'r' if mmap else None
+        courses = np.load(os.path.join(index_dir, f"{key}.courses.npy"), mmap_mode=mode)
+        matrix = np.load(os.path.join(index_dir, f"{key}.matrix.npy"), mmap_mode=mode)
+        return cls(courses, matrix)
+
+    def save(self, index_dir, key=CF_KEY):
+        np.save(os.path.join(index_dir, f"{key}.courses.npy"), self.courses)
+        np.save(os.path.join(index_dir, f"{key}.matrix.npy"), self.matrix)
+
+    def lookup(self, course_ids, waku, default=DEFAULT_SCORE):
+        """(コースID, 枠番) の列をまとめてコース枠スコアに変換します。"""
+        rows = _encode(self.courses, course_ids)
+        cols = np.asarray(waku, dtype=np.int64)
+        ok = (rows >= 0) & (cols >= 0) & (cols <= MAX_WAKU)
+        values = self.matrix[np.maximum(rows, 0), np.where(ok, cols, 0)]
+        return np.where(ok, values, default)
+
+    def row(self, course_id, default=DEFAULT_SCORE):
+        """1コース分の 枠番(0..MAX_WAKU) -> スコア の配列（無いコースは全て default）。"""
+        pos = _encode(self.courses, [course_id])[0]
+        if pos < 0:
+            return np.full(MAX_WAKU + 1, default, dtype=float)
+        return np.asarray(self.matrix[pos], dtype=float)
+
+
+def _source_signature(model_dir):
+    signature = {}
+    for fname in list(ENTITY_STATS.values()) + [CF_STATS_FILE, CF_COUNTS_FILE]:
+        st = os.stat(os.path.join(model_dir, fname))
+        signature[fname] = [st.st_mtime_ns, st.st_size]
+    return signature
+
+
+def build_index(model_dir):
+    """models/<ver>/ の統計 pickle から index/ を作ります。作成したフォルダを返します。"""
+    index_dir = os.path.join(model_dir, INDEX_DIR)
+    os.makedirs(index_dir, exist_ok=True)
+    sizes = {}
+    for key, fname in ENTITY_STATS.items():
+        index = EntityIndex.from_stats(joblib.load(os.path.join(model_dir, fname)))
+        index.save(index_dir, key)
+        sizes[key] = len(index)
+
+    cf_matrix = CourseFrameMatrix.from_stats(joblib.load(os.path.join(model_dir, CF_STATS_FILE)),
+                                             joblib.load(os.path.join(model_dir, CF_COUNTS_FILE)))
+    cf_matrix.save(index_dir)
+    sizes[CF_KEY] = len(cf_matrix)
+
+    meta = {'source': _source_signature(model_dir), 'sizes': sizes}
+    with open(os.path.join(index_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return index_dir
+
+
+def load_indexes(model_dir):
+    """
+    index/ が最新なら {キー: EntityIndex, 'cf_matrix': CourseFrameMatrix} を返します。
+    無い・元の pickle より古い場合は None を返します（pickle を使ってください）。
+    """
+    index_dir = os.path.join(model_dir, INDEX_DIR)
+    try:
+        with open(os.path.join(index_dir, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('source') != _source_signature(model_dir):
+            return None
+        indexes = {key: EntityIndex.load(index_dir, key) for key in ENTITY_STATS}
+        indexes['cf_matrix'] = CourseFrameMatrix.load(index_dir)
+        return indexes
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="統計 pickle を検索用インデックスに変換します")
+    parser.add_argument("model_dirs", nargs="+", help="models/<ver> フォルダ")
+    args = parser.parse_args()
+    for model_dir in args.model_dirs:
+        print(f"{model_dir} -> {build_index(model_dir)}")
@@ -0,0 +1,106 @@
+# stream_predict.py
+"""
+数百万行規模のCSV（jra1217.csv と同じ形式）を少しずつ読み込んで予測します。
+ファイル全体をメモリに載せず、レース単位でまとめたバッチごとに予測して書き出します。
+"""
+import pandas as pd
+
+import ingest
+import logic
+
+# 元CSVの列番号: 日付・開催・Ｒ
+DATE_COL, PLACE_COL, RACE_COL = 0, 1, 2
+
+DEFAULT_CHUNKSIZE = 50000
+DEFAULT_MAX_RACES = 200
+
+
+def _race_keys(df):
+    return list(zip(df[DATE_COL], df[PLACE_COL], df[RACE_COL]))
+
+
+def iter_race_batches(source, chunksize=DEFAULT_CHUNKSIZE, max_races=DEFAULT_MAX_RACES, encoding=None):
+    """
+    CSVを chunksize 行ずつ読み、レースを途中で分割しないバッチを順に返します。
+    1バッチは同じ日付の最大 max_races レースです。
+    （同じレースの行はファイル内で連続している前提です）
+    encoding を省略すると先頭部分から判定します。
+    """
+    reader = ingest.iter_race_card(source, chunksize, encoding=encoding)
+    buffer = None
+    for chunk in reader:
+        buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+        keys = _race_keys(buffer)
+
+        # 最後のレースは次のチャンクに続いている可能性があるので確定させません
+        cut = len(keys)
+        while cut > 0 and keys[cut - 1] == keys[-1]:
+            cut -= 1
+
+        start = 0
+        for end in _batch_ends(keys[:cut], max_races, final=False):
+            yield buffer.iloc[start:end]
+            start = end
+        buffer = buffer.iloc[start:]
+
+    if buffer is not None and len(buffer):
+        start = 0
+        for end in _batch_ends(_race_keys(buffer), max_races, final=True):
+            yield buffer.iloc[start:end]
+            start = end
+
+
+def _batch_ends(keys, max_races, final):
+    """
+    バッチの区切り位置を返します。日付が変わるところ、
+    またはレース数が max_races に達したところで区切ります。
+    final=False のときは、まだ続きが来るかもしれない末尾のバッチは返しません。
+    """
+    races = 0
+    for i in range(1, len(keys) + 1):
+        if i < len(keys) and keys[i] == keys[i - 1]:
+            continue
+        races += 1
+        if i == len(keys):
+            if final or races >= max_races:
+                yield i
+        elif keys[i][0] != keys[i - 1][0] or races >= max_races:
+            yield i
+            races = 0
+
+
+def predict_stream(source, model_dir, sink, chunksize=DEFAULT_CHUNKSIZE, max_races=DEFAULT_MAX_RACES,
+                   encoding=None, progress=None):
+    """
+    source のCSVをバッチごとに予測し、結果を sink に順次書き出します。
+    sink: 出力CSVのパス（先頭バッチでヘッダーを書き、以降は追記）
+          または 結果DataFrameを受け取る関数
+    progress: (処理済みレース数, 処理済み行数) を受け取る関数（任意）
+    戻り値は execute_prediction と同じく (集計dict, エラーメッセージ) です。
+    """
+    bundle, error_msg = logic.resolve_bundle(model_dir)
+    if error_msg:
+        return None, error_msg
+
+    summary = {'batches': 0, 'races': 0, 'rows': 0}
+    for batch in iter_race_batches(source, chunksize, max_races, encoding):
+        result_df, error_msg = logic.execute_prediction(batch, bundle)
+        if error_msg:
+            return summary, error_msg
+        if result_df.empty:
+            continue
+
+        result_df.insert(0, '日付', batch[DATE_COL].iloc[0])
+        if callable(sink):
+            sink(result_df)
+        else:
+            first = summary['batches'] == 0
+            result_df.to_csv(sink, mode='w' if first else 'a', header=first, index=False, encoding='utf-8')
+
+        summary['batches'] += 1
+        summary['races'] += result_df[['場所', 'R']].drop_duplicates().shape[0]
+        summary['rows'] += len(result_df)
+        if progress:
+            progress(summary['races'], summary['rows'])
+
+    return summary, None
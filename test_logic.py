@@ -0,0 +1,105 @@
+# test_logic.py
+"""
+execute_prediction の結果が、元のレースごとのループ（ベクトル化前の実装）と一致することを確認します。
+
+    python -m pytest -q test_logic.py
+
+学習済みモデル（jra_3y_model.pkl）はリポジトリに含まれないため、
+models/v1 の統計と benchmark.StandInModel を使います。
+"""
+import os
+
+import joblib
+import pandas as pd
+import pytest
+
+import benchmark
+import logic
+from model_bundle import STATS_FILES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CARD_FILE = os.path.join(HERE, "jra1217.csv")
+MODEL_DIR = os.path.join(HERE, "models", "v1")
+
+
+def baseline_prediction(input_df, model, stats):
+    """ベクトル化前の execute_prediction（レースごとのループ）。stats は STATS_FILES のキー -> 統計。"""
+    df_all = input_df.copy()
+    df_all.columns = [int(c) if str(c).isdigit() else c for c in df_all.columns]
+    df_all = df_all.rename(columns=logic.RENAME_MAP)
+    df_all['馬名'] = df_all['馬名'].astype(str).str.strip()
+
+    cf_stats, cf_counts = stats['cf_stats'], stats['cf_counts']
+    all_results = []
+    for (place, race_num), df in df_all.groupby(['開催', 'Ｒ']):
+        df = df.copy()
+        race_name = str(df['レース名'].iloc[0])
+        track_type = str(df['芝ダート'].iloc[0])
+        distance = str(df['距離'].iloc[0])
+        track_clean = "芝" if "芝" in track_type else ("ダ" if "ダ" in track_type else "障")
+        course_id = f"{track_clean}{distance}"
+
+        df['性別コード'] = df['性別'].map({'牡': 0, '牝': 1, 'セ': 2}).fillna(0)
+        df['年齢'] = pd.to_numeric(df['年齢'], errors='coerce').fillna(3)
+        df['枠番'] = pd.to_numeric(df['枠番'], errors='coerce').fillna(0).astype(int)
+
+        df['父スコア'] = df['種牡馬'].apply(lambda x: stats['sire_stats'].get(x, 0.2))
+        df['母父スコア'] = df['母父馬'].apply(lambda x: stats['bms_stats'].get(x, 0.2))
+        df['騎手スコア'] = df['騎手'].apply(lambda x: stats['jockey_stats'].get(x, 0.2))
+        df['調教師スコア'] = df['調教師'].apply(lambda x: stats['trainer_stats'].get(x, 0.2))
+        df['生産者スコア'] = df['生産者'].apply(lambda x: stats['breeder_stats'].get(x, 0.2))
+
+        def get_cf_score(waku):
+            try:
+                if cf_counts.loc[(course_id, waku)] < 5:
+                    return 0.2
+                return cf_stats.loc[(course_id, waku)]
+            except KeyError:
+                return 0.2
+
+        df['コース枠スコア'] = df['枠番'].apply(get_cf_score)
+        df['血統総合'] = df['父スコア'] * df['母父スコア']
+        df['チーム総合'] = df['騎手スコア'] * df['調教師スコア'] * df['生産者スコア']
+        for f in logic.FEATURES:
+            df[f] = df[f].fillna(0)
+
+        df['AI指数'] = [p[1] * 100 for p in model.predict_proba(df[logic.FEATURES])]
+        df = df.sort_values('AI指数', ascending=False, kind='stable')
+
+        for rank, (_, r) in enumerate(df.iterrows(), start=1):
+            w_val = r['コース枠スコア']
+            if w_val > 0.25:
+                w_mark = "◎"
+            elif w_val > 0.22:
+                w_mark = "○"
+            elif w_val < 0.15:
+                w_mark = "▼"
+            else:
+                w_mark = "-"
+            all_results.append({
+                '場所': place, 'R': race_num, 'レース名': race_name, 'AI順位': rank,
+                '印': "⭐" if r['AI指数'] >= 50 else "",
+                '枠': r['枠番'], '番': r['馬番'], '馬名': r['馬名'], '騎手': r['騎手'],
+                'AI指数': round(r['AI指数'], 1), '枠評': w_mark, '種牡馬': r['種牡馬'],
+            })
+    return pd.DataFrame(all_results)
+
+
+@pytest.fixture(scope="module")
+def standin():
+    if not os.path.exists(CARD_FILE) or not all(os.path.exists(os.path.join(MODEL_DIR, f)) for f in STATS_FILES.values()):
+        pytest.skip("jra1217.csv または models/v1 の統計がありません")
+    stats = {key: joblib.load(os.path.join(MODEL_DIR, fname)) for key, fname in STATS_FILES.items()}
+    return benchmark.load_standin_bundle(MODEL_DIR), stats
+
+
+def test_matches_baseline_loop(standin):
+    bundle, stats = standin
+    card = pd.read_csv(CARD_FILE, header=None, encoding='cp932')
+
+    result_df, error_msg = logic.execute_prediction(card, bundle)
+    expected = baseline_prediction(card, bundle.model, stats)
+
+    assert error_msg is None
+    assert len(result_df) == len(card)
+    pd.testing.assert_frame_equal(result_df.reset_index(drop=True), expected, check_dtype=False)
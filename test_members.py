@@ -0,0 +1,107 @@
+# test_members.py
+"""
+MemberRepository を PostgREST のスタブ（httpx.MockTransport）に対して確認します。
+
+    python -m pytest -q test_members.py
+"""
+import json
+
+import httpx
+import pytest
+
+import members
+
+REST_URL = "http://stub/rest/v1"
+API_KEY = "test-key"
+
+
+class PostgRESTStub:
+    """users テーブルだけを持つ PostgREST の簡易スタブ（eq. / in.() フィルタのみ対応）。"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.requests = []
+
+    def _match(self, row, params):
+        for col, cond in params.items():
+            if col in ("select", "order", "limit"):
+                continue
+            op, _, value = cond.partition(".")
+            cell = str(row.get(col))
+            if op == "eq" and cell != value:
+                return False
+            if op == "neq" and cell == value:
+                return False
+            if op == "in" and cell not in [v.strip('"') for v in value.strip("()").split(",")]:
+                return False
+        return True
+
+    def __call__(self, request):
+        self.requests.append(request)
+        params = dict(request.url.params)
+        hits = [r for r in self.rows if self._match(r, params)]
+        if request.method == "GET":
+            return httpx.Response(200, json=hits)
+        if request.method == "PATCH":
+            for r in hits:
+                r.update(json.loads(request.content))
+        elif request.method == "DELETE":
+            self.rows = [r for r in self.rows if r not in hits]
+        elif request.method == "POST":
+            self.rows.append(json.loads(request.content))
+        return httpx.Response(204)
+
+    def count(self, method):
+        return sum(1 for r in self.requests if r.method == method)
+
+
+@pytest.fixture
+def stub():
+    return PostgRESTStub([
+        {'id': "7c9e6679-7425-40de-944b-e07fc1f90ae7", 'username': "a", 'status': "pending", 'role': "member"},
+        {'id': "16fd2706-8baf-433b-82eb-8c7fada847da", 'username': "b", 'status': "pending", 'role': "member"},
+        {'id': "886313e1-3b8a-5372-9b90-0c9aee199e5d", 'username': "c", 'status': "pending", 'role': "member"},
+        {'id': "0a1b2c3d-0000-0000-0000-000000000000", 'username': "admin", 'status': "approved", 'role': "admin"},
+    ])
+
+
+@pytest.fixture
+def repo(stub):
+    client = httpx.Client(transport=httpx.MockTransport(stub))
+    return members.MemberRepository(REST_URL, API_KEY, client=client, ttl=60)
+
+
+def test_list_is_cached_within_ttl(repo, stub):
+    assert [u['username'] for u in repo.list_pending()] == ["a", "b", "c"]
+    repo.list_pending()
+    assert stub.count("GET") == 1
+
+
+def test_bulk_approve_is_one_patch_and_invalidates(repo, stub):
+    pending = repo.list_pending()
+    repo.approve([u['id'] for u in pending[:2]])
+
+    assert stub.count("PATCH") == 1
+    assert [u['username'] for u in repo.list_pending()] == ["c"]
+    assert [u['username'] for u in repo.list_active()] == ["a", "b"]
+    assert stub.count("GET") == 3
+
+
+def test_reject_and_register_invalidate(repo, stub):
+    pending = repo.list_pending()
+    repo.reject([pending[0]['id']])
+    assert [u['username'] for u in repo.list_pending()] == ["b", "c"]
+
+    assert repo.register("d", "pw")
+    assert not repo.register("d", "pw")
+    assert [u['username'] for u in repo.list_pending()] == ["b", "c", "d"]
+
+
+def test_injected_client_sends_auth_headers(repo, stub):
+    repo.list_pending()
+    repo.approve([stub.rows[0]['id']])
+    for request in stub.requests:
+        assert request.headers["apikey"] == API_KEY
+        assert request.headers["authorization"] == f"Bearer {API_KEY}"
+        assert request.headers["content-type"] == "application/json"
+    assert stub.requests[-1].headers["prefer"] == "return=minimal"
@@ -0,0 +1,64 @@
+# test_result_store.py
+"""
+ResultStore の公開・引き継ぎ（merge=True）の確認。
+
+    python -m pytest -q test_result_store.py
+"""
+import pandas as pd
+import pytest
+
+import result_store
+
+
+def make_result(place, race, date=None, extra=None):
+    """1レース分の予測結果（execute_prediction の結果と同じ列、date を渡すと '日付' 列付き）。"""
+    df = pd.DataFrame({
+        '場所': place, 'R': race, 'レース名': f"{place}{race}R",
+        'AI順位': [1, 2, 3], '印': ['⭐', '', ''], '枠': [1, 2, 3], '番': [1, 2, 3],
+        '馬名': ['a', 'b', 'c'], '騎手': ['x', 'y', 'z'], 'AI指数': [60.0, 40.0, 20.0],
+        '枠評': ['◎', '-', '▼'], '種牡馬': 's',
+    })
+    if extra:
+        df = df.assign(**extra)
+    if date is not None:
+        df.insert(0, '日付', date)
+    return df
+
+
+@pytest.fixture(params=sorted(set(["pickle", result_store.DEFAULT_FORMAT])))
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "DEFAULT_FORMAT", request.param)
+    return result_store.ResultStore(str(tmp_path / "results"))
+
+
+def test_merge_dated_onto_undated(store):
+    # 旧 data.csv（日付なし・列が多い）を公開した後に、日付付きの結果を追加します
+    store.publish(make_result('中山', 1, extra={'調教師': 't'}), model_version='data.csv')
+    store.publish(make_result('阪神', 2, date=251214), merge=True)
+
+    assert store.dates() == [None, 251214]
+    legacy = store.read_race('中山', 1)
+    assert '日付' not in legacy.columns
+    assert legacy['調教師'].tolist() == ['t'] * 3
+    dated = store.read_race('阪神', 2, date=251214)
+    assert dated['日付'].tolist() == [251214] * 3
+    assert store.read_display('中山', 1)['AI順位'].tolist() == [1, 2, 3]
+
+
+def test_merge_undated_onto_dated(store):
+    store.publish(make_result('阪神', 2, date=251214))
+    store.publish(make_result('中山', 1), merge=True)
+
+    assert store.dates() == [None, 251214]
+    assert store.read_race('阪神', 2, date=251214)['日付'].tolist() == [251214] * 3
+    assert '日付' not in store.read_race('中山', 1).columns
+    assert len(store.read_all()) == 6
+
+
+def test_merge_replaces_same_race(store):
+    store.publish(pd.concat([make_result('中山', 1, date=251214), make_result('中山', 2, date=251214)]))
+    store.publish(make_result('中山', 1, date=251214).assign(馬名=['d', 'e', 'f']), merge=True)
+
+    assert store.races('中山', date=251214) == [1, 2]
+    assert store.read_race('中山', 1, date=251214)['馬名'].tolist() == ['d', 'e', 'f']
+    assert store.read_race('中山', 2, date=251214)['馬名'].tolist() == ['a', 'b', 'c']